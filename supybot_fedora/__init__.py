@@ -57,8 +57,22 @@ __contributors__ = {
 __url__ = ""  # 'http://supybot.com/Members/yourname/Fedora/download'
 
 from . import config
+from . import accounts
+from . import caches
+from . import karmadb
+from . import meetings
+from . import packages
+from . import webclient
+from . import workers
 from . import plugin
 
+importlib.reload(accounts)
+importlib.reload(caches)
+importlib.reload(karmadb)
+importlib.reload(meetings)
+importlib.reload(packages)
+importlib.reload(webclient)
+importlib.reload(workers)
 importlib.reload(plugin)  # In case we're being reloaded.
 # Add more reloads here if you add third-party modules and want them to be
 # reloaded when this plugin is reloaded.  Don't forget to import them as well!
@@ -0,0 +1,401 @@
+###
+# Copyright (c) 2007, Mike McGrath
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+"""
+In-memory indexes over the Fedora account data cached by the plugin.
+"""
+
+import base64
+import json
+import os
+import sys
+import time
+from array import array
+
+import supybot.ircutils as ircutils
+
+# Bump this whenever the layout of the dumped caches changes, so that old
+# snapshots get ignored rather than misread.
+SNAPSHOT_VERSION = 3
+
+
+def _encode_posting(posting):
+    return base64.b64encode(posting.tobytes()).decode("ascii")
+
+
+def _decode_posting(text):
+    return array("I", base64.b64decode(text))
+
+
+# Length of the n-grams used by the substring index.  Queries shorter than
+# this cannot be answered from the index, and only match whole usernames and
+# nicks.
+GRAM_SIZE = 3
+
+# Number of candidates up to which the matches of a search are all counted.
+# Past that, their number is estimated from the size of the posting lists.
+COUNT_LIMIT = 1000
+
+
+def _grams(text):
+    grams = set()
+    for start in range(len(text) - GRAM_SIZE + 1):
+        end = start + GRAM_SIZE
+        grams.add(text[start:end])
+    return grams
+
+
+class Account(object):
+    """What we cache about an account.
+
+    Usernames and nicks are interned, so that the many maps keyed on them
+    all share a single copy of each.  The lowercased text searched by the fas
+    command is kept in ``haystack``, so that searches don't rebuild it.
+    """
+
+    __slots__ = ("username", "human_name", "email", "nicks", "haystack")
+
+    def __init__(self, username, human_name, email, nicks):
+        self.username = sys.intern(username)
+        self.human_name = human_name or ""
+        self.email = email or ""
+        self.nicks = tuple(sys.intern(nick) for nick in nicks)
+        fields = (self.username, self.email, self.human_name) + self.nicks
+        self.haystack = " ".join(fields).lower()
+
+    def astuple(self):
+        return self.username, self.human_name, self.email, self.nicks
+
+    def display(self):
+        """Return the string we reply with for this account."""
+        return "%s '%s' <%s>" % (self.username, self.human_name, self.email)
+
+
+class AccountCache(object):
+    """Everything the plugin caches about accounts.
+
+    Accounts are stored once, in a table indexed by an integer id, next to
+    the maps the plugin looks them up with:
+
+    - ``uids``, from usernames to ids,
+    - ``nickmap``, from IRC nicks to usernames, and ``folded_nicks`` from
+      the lowercase version of the nicks which are not lowercase already,
+    - ``postings``, a trigram inverted index for substring searches.  For
+      each trigram appearing in the searchable text of an account (username,
+      email, human name and IRC nicks), it keeps an array of the ids
+      containing it, in increasing order.  ``username_postings`` and
+      ``nick_postings`` are the same for usernames and nicks alone, which
+      rank first in searches.
+
+    A full refresh builds a whole new AccountCache and then replaces the old
+    one by rebinding a single attribute, so readers only ever see a complete
+    cache.  Readers needing several lookups should grab the AccountCache once
+    rather than going through the plugin every time.
+
+    An incremental sync rather updates a copy of the cache, one account at a
+    time, and swaps it in the same way.  An updated account gets a new id,
+    old ids are not taken out of the posting lists, their slot in the table
+    is only emptied.
+    """
+
+    def __init__(self, timestamp=None):
+        self.timestamp = timestamp
+        self.table = []
+        self.uids = {}
+        self.nickmap = {}
+        self.folded_nicks = {}
+        self.postings = {}
+        self.username_postings = {}
+        self.nick_postings = {}
+        self.deleted = 0
+
+    def __len__(self):
+        return len(self.uids)
+
+    def __contains__(self, name):
+        return self.resolve(name) is not None
+
+    def get(self, username):
+        """Return the Account of a username, or None."""
+        uid = self.uids.get(username)
+        return None if uid is None else self.table[uid]
+
+    def resolve(self, name):
+        """Return the username for an IRC nick or username, or None.
+
+        IRC nicks win over usernames, since this is mostly fed with what
+        people type on IRC, and exact nicks over case-insensitive ones.
+        """
+        if name in self.nickmap:
+            return self.nickmap[name]
+        if name in self.uids:
+            return name
+        folded = ircutils.toLower(name)
+        return self.folded_nicks.get(folded) or self.nickmap.get(folded)
+
+    def add(self, username, human_name, email, nicks):
+        """Cache an account, replacing any previous version of it."""
+        account = Account(username, human_name, email, nicks)
+        username = account.username
+        uid = len(self.table)
+        self.table.append(account)
+        for postings, text in [
+            (self.postings, account.haystack),
+            (self.username_postings, username.lower()),
+            (self.nick_postings, " ".join(account.nicks).lower()),
+        ]:
+            for gram in _grams(text):
+                posting = postings.get(gram)
+                if posting is None:
+                    posting = postings[gram] = array("I")
+                posting.append(uid)
+        for nick in account.nicks:
+            self.nickmap[nick] = username
+            # Most nicks are already lowercase, only keep the others.
+            folded = ircutils.toLower(nick)
+            if folded != nick:
+                self.folded_nicks.setdefault(folded, username)
+        old_uid = self.uids.get(username)
+        self.uids[username] = uid
+        self._delete(old_uid)
+
+    def update(self, username, human_name, email, nicks):
+        """Add or update an account.
+
+        Return "added" or "changed", or None if the account was up to date.
+        """
+        nicks = tuple(nicks)
+        old = self.get(username)
+        if old is not None and old.astuple() == (
+            username,
+            human_name or "",
+            email or "",
+            nicks,
+        ):
+            return None
+        self.add(username, human_name, email, nicks)
+        if old is None:
+            return "added"
+        self._forget_nicks(username, set(old.nicks) - set(nicks))
+        return "changed"
+
+    def remove(self, username):
+        uid = self.uids.pop(username, None)
+        if uid is not None:
+            self._forget_nicks(username, self.table[uid].nicks)
+            self._delete(uid)
+
+    def _forget_nicks(self, username, nicks):
+        for nick in nicks:
+            if self.nickmap.get(nick) == username:
+                del self.nickmap[nick]
+            folded = ircutils.toLower(nick)
+            if self.folded_nicks.get(folded) == username:
+                del self.folded_nicks[folded]
+
+    def _delete(self, uid):
+        if uid is not None:
+            self.table[uid] = None
+            self.deleted += 1
+
+    def copy(self):
+        """Return a copy of this cache, which can be updated on its own."""
+        accounts = AccountCache(timestamp=self.timestamp)
+        accounts.table = list(self.table)
+        accounts.uids = dict(self.uids)
+        accounts.nickmap = dict(self.nickmap)
+        accounts.folded_nicks = dict(self.folded_nicks)
+        for name in ("postings", "username_postings", "nick_postings"):
+            postings = getattr(accounts, name)
+            for gram, posting in getattr(self, name).items():
+                postings[gram] = posting[:]
+        accounts.deleted = self.deleted
+        return accounts
+
+    def compacted(self):
+        """Return a copy of this cache without the deleted ids."""
+        accounts = AccountCache(timestamp=self.timestamp)
+        for account in self.table:
+            if account is not None:
+                accounts.add(*account.astuple())
+        return accounts
+
+    def _shortest_posting(self, postings, query):
+        """Return the shortest posting list of the trigrams of a query.
+
+        Every account containing the query is in it, it is rather verified
+        than intersected with the others, which can be nearly as long as the
+        whole table.
+        """
+        shortest = None
+        for gram in _grams(query):
+            posting = postings.get(gram)
+            if posting is None:
+                return ()
+            if shortest is None or len(posting) < len(shortest):
+                shortest = posting
+        return shortest
+
+    def search(self, query, limit):
+        """Find the accounts matching a query.
+
+        Returns a tuple of the display strings of at most ``limit`` matches,
+        best first (exact username, exact nick, then partial username, nick
+        and finally name or email matches), the total number of matches and
+        whether that number is exact rather than estimated.  Matches of the
+        same rank come in the order their accounts were cached.
+
+        Queries shorter than GRAM_SIZE only match exact usernames and nicks.
+        Otherwise the candidates are walked in order, and the walk stops as
+        soon as no later candidate could make it into the ``limit`` best.
+        """
+        query = query.lower()
+        table = self.table
+        exact = []
+        for username in (query, self.resolve(query)):
+            uid = self.uids.get(username)
+            if uid is not None and uid not in exact:
+                exact.append(uid)
+        if len(query) < GRAM_SIZE:
+            return [table[uid].display() for uid in exact[:limit]], len(exact), True
+
+        # Each rank is then walked in turn, in the order the accounts were
+        # cached, until no later account can make it into the best ones.
+        best = list(exact)
+        found = set(exact)
+        for postings, matches in [
+            (self.username_postings, lambda a: query in a.username.lower()),
+            (self.nick_postings, lambda a: any(query in n.lower() for n in a.nicks)),
+        ]:
+            for uid in self._shortest_posting(postings, query):
+                if len(best) >= limit:
+                    break
+                account = table[uid]
+                if account is not None and uid not in found and matches(account):
+                    best.append(uid)
+                    found.add(uid)
+
+        # The walk over names and emails also counts all the matches, unless
+        # there are too many candidates.
+        posting = self._shortest_posting(self.postings, query)
+        counted = len(posting) <= COUNT_LIMIT
+        total = 0
+        for uid in posting:
+            if len(best) >= limit and not counted:
+                break
+            account = table[uid]
+            if account is None or query not in account.haystack:
+                continue
+            total += 1
+            if len(best) < limit and uid not in found:
+                best.append(uid)
+        if not counted:
+            total = max(len(posting), len(best))
+        return [table[uid].display() for uid in best[:limit]], total, counted
+
+    def dump(self):
+        return (
+            [None if a is None else a.astuple() for a in self.table],
+            self.nickmap,
+            self.folded_nicks,
+            {gram: _encode_posting(posting) for gram, posting in self.postings.items()},
+            {
+                gram: _encode_posting(posting)
+                for gram, posting in self.username_postings.items()
+            },
+            {
+                gram: _encode_posting(posting)
+                for gram, posting in self.nick_postings.items()
+            },
+        )
+
+    @classmethod
+    def load(cls, data, timestamp):
+        accounts = cls(timestamp)
+        (
+            table,
+            accounts.nickmap,
+            accounts.folded_nicks,
+            postings,
+            usernames,
+            nicks,
+        ) = data
+        for uid, record in enumerate(table):
+            if record is None:
+                accounts.table.append(None)
+                accounts.deleted += 1
+            else:
+                account = Account(*record)
+                accounts.table.append(account)
+                accounts.uids[account.username] = uid
+        for gram, posting in postings.items():
+            accounts.postings[gram] = _decode_posting(posting)
+        for gram, posting in usernames.items():
+            accounts.username_postings[gram] = _decode_posting(posting)
+        for gram, posting in nicks.items():
+            accounts.nick_postings[gram] = _decode_posting(posting)
+        return accounts
+
+
+def save_snapshot(path, accounts):
+    """Write the account cache to disk, replacing any previous snapshot.
+
+    Snapshots are plain JSON, so that reading one never runs any code even
+    if someone else managed to write it.
+    """
+    data = {
+        "version": SNAPSHOT_VERSION,
+        "timestamp": accounts.timestamp,
+        "accounts": accounts.dump(),
+    }
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(path, max_age):
+    """Read the account cache back from disk.
+
+    Return None if there is no usable snapshot younger than ``max_age``
+    seconds.
+    """
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None
+    if data.get("version") != SNAPSHOT_VERSION:
+        return None
+    if time.time() - data["timestamp"] > max_age:
+        return None
+    return AccountCache.load(data["accounts"], data["timestamp"])
+
+
+# vim:set shiftwidth=4 tabstop=4 expandtab textwidth=79:
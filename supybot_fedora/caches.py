@@ -0,0 +1,325 @@
+###
+# Copyright (c) 2007, Mike McGrath
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+"""
+Small caches for data the plugin fetches from remote services.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import supybot.log as log
+
+
+class CachedValue(object):
+    """A single remotely fetched value, kept for ``ttl`` seconds.
+
+    Once the value has reached ``refresh_ahead`` of its lifetime, the next
+    read submits a refresh to the ``workers`` pool while still returning the
+    cached value.  An expired value is served the same way, so callers only
+    ever wait on the very first fetch.
+
+    After a failed refresh, the old value keeps being served without trying
+    again for ``retry_after`` seconds, so that a service being down does not
+    cost a new attempt on every read.
+    """
+
+    def __init__(self, name, fetch, ttl, workers, refresh_ahead=0.8, retry_after=60):
+        self.name = name
+        self.fetch = fetch
+        self.ttl = ttl
+        self.workers = workers
+        self.refresh_ahead = refresh_ahead
+        self.retry_after = retry_after
+        self.value = None
+        self.fetched_at = None
+        self.failed_at = None
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    @property
+    def age(self):
+        """Seconds since the value was last fetched, or None."""
+        if self.fetched_at is None:
+            return None
+        return time.time() - self.fetched_at
+
+    def get(self):
+        age = self.age
+        if age is not None and age < self.ttl:
+            self.hits += 1
+            if age >= self.ttl * self.refresh_ahead:
+                self._refresh_in_background()
+            return self.value
+
+        self.misses += 1
+        if age is None:
+            return self._refresh()
+        self._refresh_in_background()
+        return self.value
+
+    def _refresh(self):
+        value = self.fetch()
+        self.value, self.fetched_at = value, time.time()
+        self.failed_at = None
+        return value
+
+    def _backing_off(self):
+        if self.failed_at is None:
+            return False
+        return time.time() - self.failed_at < self.retry_after
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing or self._backing_off():
+                return
+            self._refreshing = True
+
+        def refresh():
+            try:
+                self._refresh()
+            except Exception:
+                self.errors += 1
+                self.failed_at = time.time()
+                log.exception("Could not refresh %s, serving a stale value" % self.name)
+            finally:
+                self._refreshing = False
+
+        self.workers.submit(refresh)
+
+    def stats(self):
+        age = self.age
+        return "%s: %s, %i hits, %i misses, %i errors" % (
+            self.name,
+            "empty" if age is None else "%is old" % age,
+            self.hits,
+            self.misses,
+            self.errors,
+        )
+
+
+class ResponseCache(object):
+    """A bounded cache of the responses of remote services.
+
+    Entries are keyed by a tuple of the service and the normalized argument
+    of the lookup, and the least recently used ones are evicted once there
+    are more than ``size`` of them.  Each entry is fresh for the ``ttl`` it
+    was fetched with, or ``negative_ttl`` if the fetch returned None, which
+    is how lookups tell that something does not exist.
+
+    After expiring, an entry is still served for ``stale_ttl`` seconds while
+    it gets fetched again in the ``workers`` pool.  If a fetch fails, the
+    expired entry is served instead of raising.
+
+    Lookups missing the same key at the same time are coalesced: only the
+    first one fetches it, the others wait for its result.
+    """
+
+    def __init__(self, name, size, stale_ttl, negative_ttl, workers):
+        self.name = name
+        self.workers = workers
+        self.size = size
+        self.stale_ttl = stale_ttl
+        self.negative_ttl = negative_ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._fetching = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, fetch, ttl):
+        """Return the cached value for key, calling fetch() if needed."""
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+        if entry is not None:
+            value, expires = entry
+            now = time.time()
+            if now < expires:
+                self.hits += 1
+                return value
+            if now < expires + self.stale_ttl:
+                self.stale_hits += 1
+                self._refresh_in_background(key, fetch, ttl)
+                return value
+
+        self.misses += 1
+        try:
+            return self._fetch_once(key, fetch, ttl)
+        except Exception:
+            if entry is None:
+                raise
+            self.errors += 1
+            log.exception("Could not refresh %r, serving a stale value" % (key,))
+            return entry[0]
+
+    def invalidate(self, key):
+        with self._lock:
+            self.entries.pop(key, None)
+
+    def _fetch_once(self, key, fetch, ttl):
+        """Fetch key, or wait for the fetch of it already going on."""
+        with self._lock:
+            fetching = self._fetching.get(key)
+            if fetching is None:
+                fetching = self._fetching[key] = Future()
+                first = True
+            else:
+                self.coalesced += 1
+                first = False
+        if not first:
+            return fetching.result()
+        try:
+            value = self._refresh(key, fetch, ttl)
+        except Exception as e:
+            fetching.set_exception(e)
+            raise
+        else:
+            fetching.set_result(value)
+            return value
+        finally:
+            with self._lock:
+                del self._fetching[key]
+
+    def _refresh(self, key, fetch, ttl):
+        value = fetch()
+        expires = time.time() + (self.negative_ttl if value is None else ttl)
+        with self._lock:
+            self.entries[key] = (value, expires)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def _refresh_in_background(self, key, fetch, ttl):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self._refresh(key, fetch, ttl)
+            except Exception:
+                self.errors += 1
+                log.exception("Could not refresh %r in the background" % (key,))
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        self.workers.submit(refresh)
+
+    def stats(self):
+        lookups = self.hits + self.stale_hits + self.misses
+        ratio = (self.hits + self.stale_hits) / lookups if lookups else 0
+        return (
+            "%s: %i/%i entries, %i hits (%i stale), %i misses (%i coalesced), "
+            "%i evictions, %i errors, %i%% hit ratio"
+            % (
+                self.name,
+                len(self),
+                self.size,
+                self.hits + self.stale_hits,
+                self.stale_hits,
+                self.misses,
+                self.coalesced,
+                self.evictions,
+                self.errors,
+                ratio * 100,
+            )
+        )
+
+
+class BucketCache(object):
+    """Counts of events in time buckets aligned on the wall clock.
+
+    Each series of buckets is cached under a key made of what is counted and
+    the width of its buckets.  Bucket n of a series covers the Unix times
+    from n * width to (n + 1) * width, so that the same buckets come out of
+    every computation, whenever it is made.  Only closed buckets should be
+    stored, as their counts are kept until they are ``max_age`` seconds older
+    than the newest bucket of their series.
+    """
+
+    def __init__(self, name, max_age):
+        self.name = name
+        self.max_age = max_age
+        self.series = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(buckets) for buckets in self.series.values())
+
+    def get(self, key, indices):
+        """Return a dict of the cached counts of some of the buckets."""
+        with self._lock:
+            buckets = self.series.get(key, {})
+            counts = {n: buckets[n] for n in indices if n in buckets}
+        self.hits += len(counts)
+        self.misses += len(indices) - len(counts)
+        return counts
+
+    def store(self, key, width, counts):
+        """Cache the counts of closed buckets, given as a dict."""
+        with self._lock:
+            buckets = self.series.setdefault(key, {})
+            buckets.update(counts)
+            if not buckets:
+                return
+            oldest = max(buckets) - self.max_age // width
+            for n in [n for n in buckets if n < oldest]:
+                del buckets[n]
+
+    def stats(self):
+        return "%s: %i buckets, %i hits, %i misses" % (
+            self.name,
+            len(self),
+            self.hits,
+            self.misses,
+        )
+
+
+# vim:set shiftwidth=4 tabstop=4 expandtab textwidth=79:
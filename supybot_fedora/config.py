@@ -31,6 +31,10 @@ import supybot.conf as conf
 import supybot.registry as registry
 
 
+class KarmaBackend(registry.OnlySomeStrings):
+    validStrings = ("sqlite", "shelve")
+
+
 def configure(advanced):
     # This will be called by supybot to configure this module.  advanced is
     # a bool that specifies whether the user identified himself as an advanced
@@ -93,6 +97,13 @@ conf.registerGlobalValue(
     "password",
     registry.String("", """Password for the Fedora Account System""", private=True),
 )
+conf.registerGlobalValue(
+    Fedora.fas,
+    "search_limit",
+    registry.PositiveInteger(
+        15, """Maximum number of accounts listed in reply to the fas command"""
+    ),
+)
 
 conf.registerGroup(Fedora, "fasjson")
 conf.registerGlobalValue(
@@ -112,6 +123,70 @@ conf.registerGlobalValue(
         "Refresh the FASJSON cache on startup. (typically only turned off for testing purposes)",
     ),
 )
+conf.registerGlobalValue(
+    Fedora.fasjson,
+    "refresh_interval",
+    registry.NonNegativeInteger(
+        21600,
+        """Number of seconds between two refreshes of the user cache, which
+        happen in the background.  0 to only refresh on startup and on the
+        refresh command.""",
+    ),
+)
+conf.registerGlobalValue(
+    Fedora.fasjson,
+    "refresh_jitter",
+    registry.NonNegativeInteger(
+        600,
+        """Maximum number of seconds randomly added to the refresh interval, so
+        that several bots don't all hit FASJSON at once.""",
+    ),
+)
+conf.registerGlobalValue(
+    Fedora.fasjson,
+    "cache_freshness",
+    registry.NonNegativeInteger(
+        86400,
+        """Maximum age in seconds of the user cache for hellomynameis,
+        himynameis and wikilink to answer from it rather than asking FASJSON.
+        0 to always ask FASJSON.""",
+    ),
+)
+conf.registerGlobalValue(
+    Fedora.fasjson,
+    "incremental_sync",
+    registry.Boolean(
+        True,
+        """Refresh the user cache by only applying the accounts that were added,
+        changed or removed, rather than rebuilding it from scratch.""",
+    ),
+)
+conf.registerGlobalValue(
+    Fedora.fasjson,
+    "page_size",
+    registry.PositiveInteger(
+        1000, """Number of users fetched per FASJSON request when refreshing."""
+    ),
+)
+conf.registerGlobalValue(
+    Fedora.fasjson,
+    "snapshot_path",
+    registry.String(
+        "fedora-users.snapshot",
+        """Path to a snapshot of the user cache on disk, used to start up
+        without waiting for the whole user list to download.  Relative paths
+        are in the data directory of the bot.  Empty to disable.""",
+    ),
+)
+conf.registerGlobalValue(
+    Fedora.fasjson,
+    "snapshot_max_age",
+    registry.PositiveInteger(
+        86400,
+        """Maximum age in seconds of a user cache snapshot for it to be used on
+        startup.  The cache is then refreshed in the background.""",
+    ),
+)
 
 conf.registerGroup(Fedora, "github")
 conf.registerGlobalValue(
@@ -119,14 +194,244 @@ conf.registerGlobalValue(
     "oauth_token",
     registry.String("", """OAuth Token for the GitHub""", private=True),
 )
+conf.registerGlobalValue(
+    Fedora.github,
+    "etag_cache_size",
+    registry.PositiveInteger(
+        500,
+        """Number of GitHub API responses kept to be revalidated with their
+        ETag.  Changes take effect when the plugin is reloaded.""",
+    ),
+)
+conf.registerGlobalValue(
+    Fedora.github,
+    "rate_limit_reserve",
+    registry.NonNegativeInteger(
+        100,
+        """Number of GitHub API requests left under which only the responses
+        we already have are used, until the rate limit is reset.""",
+    ),
+)
+
+
+conf.registerGroup(Fedora, "workers")
+conf.registerGlobalValue(
+    Fedora.workers,
+    "size",
+    registry.PositiveInteger(
+        8,
+        """Number of threads the commands making several requests at once
+        share to make them.  Changes take effect when the plugin is
+        reloaded.""",
+    ),
+)
+conf.registerGlobalValue(
+    Fedora.workers,
+    "max_batch",
+    registry.PositiveInteger(
+        10,
+        """Maximum number of names a single command looks up at once, so that
+        one command cannot take all the threads for itself.""",
+    ),
+)
 
 
+conf.registerGroup(Fedora, "http")
+conf.registerGlobalValue(
+    Fedora.http,
+    "retries",
+    registry.NonNegativeInteger(
+        2,
+        """Number of times a request failing to connect or getting a 502, 503
+        or 504 response is retried.""",
+    ),
+)
+conf.registerGlobalValue(
+    Fedora.http,
+    "pool_size",
+    registry.PositiveInteger(
+        10, """Number of connections kept alive to each remote host."""
+    ),
+)
+conf.registerGlobalValue(
+    Fedora.http,
+    "connect_timeout",
+    registry.PositiveFloat(
+        5, """Timeout in seconds to establish a connection to a remote host."""
+    ),
+)
+conf.registerGlobalValue(
+    Fedora.http,
+    "command_deadline",
+    registry.PositiveFloat(
+        60,
+        """Time in seconds a command making several requests may spend on
+        them before giving up on the remaining ones.""",
+    ),
+)
+conf.registerGroup(Fedora.http, "timeouts")
+for service, timeout in [
+    ("badges", 30),
+    ("datagrepper", 30),
+    ("distgit", 30),
+    ("fedocal", 30),
+    ("github", 30),
+    ("mdapi", 30),
+    ("mirrormanager", 45),
+    ("pagure", 30),
+    ("pdc", 15),
+]:
+    conf.registerGlobalValue(
+        Fedora.http.timeouts,
+        service,
+        registry.PositiveFloat(
+            timeout,
+            """Timeout in seconds waiting for a response from %s.""" % service,
+        ),
+    )
+
+conf.registerGroup(Fedora, "cache")
+conf.registerGlobalValue(
+    Fedora.cache,
+    "size",
+    registry.PositiveInteger(
+        1000,
+        """Maximum number of responses of the lookup commands kept in the
+        cache.  Changes take effect when the plugin is reloaded.""",
+    ),
+)
+conf.registerGlobalValue(
+    Fedora.cache,
+    "stale_ttl",
+    registry.NonNegativeInteger(
+        3600,
+        """Seconds an expired response is still served for, while it is
+        fetched again in the background.""",
+    ),
+)
+conf.registerGlobalValue(
+    Fedora.cache,
+    "negative_ttl",
+    registry.NonNegativeInteger(
+        300,
+        """Seconds for which a lookup of something that does not exist is
+        cached.""",
+    ),
+)
+conf.registerGroup(Fedora.cache, "ttl")
+for command, ttl in [
+    ("badges", 900),
+    ("group", 3600),
+    ("members", 900),
+    ("meetings", 600),
+    ("mirroradmins", 3600),
+    ("sponsors", 900),
+    ("users", 300),
+    ("what", 86400),
+    ("whoowns", 3600),
+]:
+    conf.registerGlobalValue(
+        Fedora.cache.ttl,
+        command,
+        registry.NonNegativeInteger(
+            ttl, """Seconds for which the responses of %s are cached.""" % command
+        ),
+    )
+
+conf.registerGroup(Fedora, "packages")
+conf.registerGlobalValue(
+    Fedora.packages,
+    "primary_db",
+    registry.String(
+        "",
+        """Path to the primary.sqlite metadata of a Fedora repository, which
+        the what command reads the package summaries from before asking
+        mdapi.  Empty to disable.""",
+    ),
+)
+conf.registerGlobalValue(
+    Fedora.packages,
+    "acl_dump",
+    registry.String(
+        "",
+        """Path to a JSON dump of the dist-git access lists of the rpms,
+        which the whoowns command reads the owners from before asking
+        dist-git.  Empty to disable.""",
+    ),
+)
+conf.registerGlobalValue(
+    Fedora.packages,
+    "refresh_interval",
+    registry.NonNegativeInteger(
+        3600,
+        """Seconds between checks for updated package dumps on disk.  0 to
+        only load them when the plugin is loaded.""",
+    ),
+)
+conf.registerGlobalValue(
+    Fedora.packages,
+    "suggestions",
+    registry.NonNegativeInteger(
+        3,
+        """Maximum number of package names suggested when a package is not
+        found.""",
+    ),
+)
+
+conf.registerGroup(Fedora, "quote")
+conf.registerGlobalValue(
+    Fedora.quote,
+    "max_pages",
+    registry.PositiveInteger(
+        10,
+        """Maximum number of pages of messages fetched to draw a sparkline.
+        Past that, datagrepper is asked to count the messages of each point
+        of the sparkline instead.""",
+    ),
+)
+conf.registerGlobalValue(
+    Fedora.quote,
+    "cache_max_age",
+    registry.PositiveInteger(
+        7862400,
+        """Age in seconds up to which the message counts of the points of
+        sparklines are kept.""",
+    ),
+)
+
 conf.registerGroup(Fedora, "karma")
 conf.registerGlobalValue(
     Fedora.karma,
     "db_path",
     registry.String("/var/tmp/supybot-karma.db", """Path to a karma db on disk"""),
 )
+conf.registerGlobalValue(
+    Fedora.karma,
+    "backend",
+    KarmaBackend(
+        "sqlite",
+        """Storage engine for karma votes.  When switching to sqlite, the votes
+        of the shelve db at karma.db_path are imported once.""",
+    ),
+)
+conf.registerGlobalValue(
+    Fedora.karma,
+    "sqlite_path",
+    registry.String(
+        "",
+        """Path to the sqlite karma db on disk.  Defaults to karma.db_path with
+        a .sqlite suffix.""",
+    ),
+)
+conf.registerGlobalValue(
+    Fedora.karma,
+    "release_ttl",
+    registry.PositiveInteger(
+        3600,
+        """Number of seconds the current Fedora release is cached for before
+        asking PDC again""",
+    ),
+)
 conf.registerGlobalValue(
     Fedora.karma,
     "url",
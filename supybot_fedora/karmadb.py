@@ -0,0 +1,364 @@
+###
+# Copyright (c) 2007, Mike McGrath
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+"""
+Storage engines for karma votes.
+"""
+
+import copy
+import dbm
+import shelve
+import sqlite3
+import threading
+
+
+class KarmaStore(object):
+    """The interface every karma storage engine implements.
+
+    A vote is what ``agent`` gave ``recipient`` during ``release``: 1 or -1.
+    An agent has a single vote per recipient and release, which they can
+    flip.
+    """
+
+    # Whether totals are kept next to the votes, rather than counted
+    maintains_totals = False
+
+    def vote(self, release, agent, recipient, vote):
+        """Record a vote.
+
+        Return False if the agent had already given that same vote.
+        """
+        raise NotImplementedError()
+
+    def release_totals(self, release, recipient):
+        """Return how many times recipient was (increased, decreased)."""
+        raise NotImplementedError()
+
+    def alltime_totals(self, recipient):
+        """Return release_totals summed over every release."""
+        raise NotImplementedError()
+
+    def rebuild_totals(self):
+        """Recompute the maintained totals from the votes, if any.
+
+        Return the number of (release, recipient) totals that had drifted.
+        """
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+class ShelveKarmaStore(KarmaStore):
+    """The historical storage: a shelve of dicts of dicts.
+
+    For every release, ``forwards-<release>`` maps agents to the votes they
+    gave, and ``backwards-<release>`` maps recipients to the votes they got.
+    """
+
+    def __init__(self, path, get_current_release):
+        self.path = path
+        self.get_current_release = get_current_release
+        self._lock = threading.Lock()
+
+    def open(self):
+        data = shelve.open(self.path)
+        if "backwards" in data:
+            # This is the old style data.  convert it to the new form.
+            release = self.get_current_release()
+            data["forwards-" + release] = copy.copy(data["forwards"])
+            data["backwards-" + release] = copy.copy(data["backwards"])
+            del data["forwards"]
+            del data["backwards"]
+            data.sync()
+        return data
+
+    def vote(self, release, agent, recipient, vote):
+        with self._lock:
+            data = self.open()
+            try:
+                fkey = "forwards-" + release
+                bkey = "backwards-" + release
+                forwards = data.get(fkey, {})
+                if forwards.get(agent, {}).get(recipient) == vote:
+                    return False
+                forwards.setdefault(agent, {})[recipient] = vote
+                data[fkey] = forwards
+
+                backwards = data.get(bkey, {})
+                backwards.setdefault(recipient, {})[agent] = vote
+                data[bkey] = backwards
+                return True
+            finally:
+                data.close()
+
+    def _totals(self, votes):
+        votes = list(votes.values())
+        return votes.count(1), votes.count(-1)
+
+    def release_totals(self, release, recipient):
+        with self._lock:
+            data = self.open()
+            try:
+                votes = data.get("backwards-" + release, {}).get(recipient, {})
+            finally:
+                data.close()
+        return self._totals(votes)
+
+    def alltime_totals(self, recipient):
+        inc = dec = 0
+        with self._lock:
+            data = self.open()
+            try:
+                for key in data:
+                    if "backwards-" not in key:
+                        continue
+                    release_inc, release_dec = self._totals(
+                        data[key].get(recipient, {})
+                    )
+                    inc += release_inc
+                    dec += release_dec
+            finally:
+                data.close()
+        return inc, dec
+
+    def rebuild_totals(self):
+        # Totals are counted from the votes on every lookup, none can drift.
+        return 0
+
+
+def _count_drift(rows, counted):
+    """Count the totals of rows which differ from the counted ones.
+
+    Rows end with the (inc, dec) counters, keyed on what comes before them.
+    """
+    maintained = {tuple(row[:-2]): tuple(row[-2:]) for row in rows}
+    return len(
+        [
+            key
+            for key in set(maintained) | set(counted)
+            if maintained.get(key, (0, 0)) != counted.get(key, (0, 0))
+        ]
+    )
+
+
+class SQLiteKarmaStore(KarmaStore):
+    """Karma votes stored one row per vote in a SQLite database.
+
+    Next to the votes, running (increased, decreased) counters are kept per
+    release and recipient, and per recipient for all time.  They are updated
+    in the same transaction as the vote, so looking up totals costs the
+    same however many votes and releases there are.
+
+    The database runs in WAL mode so that readers don't block the writer.  A
+    single connection is shared by all the plugin threads and serialized with
+    a lock, every vote being its own transaction.
+    """
+
+    maintains_totals = True
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS votes (
+            release TEXT NOT NULL,
+            agent TEXT NOT NULL,
+            recipient TEXT NOT NULL,
+            vote INTEGER NOT NULL,
+            PRIMARY KEY (release, agent, recipient)
+        );
+        CREATE INDEX IF NOT EXISTS votes_recipient ON votes (release, recipient);
+        CREATE TABLE IF NOT EXISTS totals (
+            release TEXT NOT NULL,
+            recipient TEXT NOT NULL,
+            inc INTEGER NOT NULL,
+            dec INTEGER NOT NULL,
+            PRIMARY KEY (release, recipient)
+        );
+        CREATE TABLE IF NOT EXISTS alltime_totals (
+            recipient TEXT PRIMARY KEY,
+            inc INTEGER NOT NULL,
+            dec INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.executescript(self.schema)
+        if not self._get_meta("totals"):
+            # Databases created before the totals were maintained.
+            self.rebuild_totals()
+
+    def _get_meta(self, key):
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT value FROM meta WHERE key = ?", (key,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def _update_totals(self, release, recipient, inc, dec):
+        self.conn.execute(
+            "INSERT INTO totals (release, recipient, inc, dec) VALUES (?, ?, ?, ?)"
+            " ON CONFLICT (release, recipient)"
+            " DO UPDATE SET inc = inc + excluded.inc, dec = dec + excluded.dec",
+            (release, recipient, inc, dec),
+        )
+        self.conn.execute(
+            "INSERT INTO alltime_totals (recipient, inc, dec) VALUES (?, ?, ?)"
+            " ON CONFLICT (recipient)"
+            " DO UPDATE SET inc = inc + excluded.inc, dec = dec + excluded.dec",
+            (recipient, inc, dec),
+        )
+
+    def vote(self, release, agent, recipient, vote):
+        with self._lock, self.conn:
+            row = self.conn.execute(
+                "SELECT vote FROM votes"
+                " WHERE release = ? AND agent = ? AND recipient = ?",
+                (release, agent, recipient),
+            ).fetchone()
+            if row is not None and row[0] == vote:
+                return False
+            self.conn.execute(
+                "INSERT OR REPLACE INTO votes (release, agent, recipient, vote)"
+                " VALUES (?, ?, ?, ?)",
+                (release, agent, recipient, vote),
+            )
+            # A flipped vote moves one count from a counter to the other.
+            inc = 1 if vote == 1 else 0
+            dec = 1 if vote == -1 else 0
+            if row is not None:
+                inc, dec = inc - dec, dec - inc
+            self._update_totals(release, recipient, inc, dec)
+            return True
+
+    def release_totals(self, release, recipient):
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT inc, dec FROM totals WHERE release = ? AND recipient = ?",
+                (release, recipient),
+            ).fetchone()
+        return row or (0, 0)
+
+    def alltime_totals(self, recipient):
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT inc, dec FROM alltime_totals WHERE recipient = ?",
+                (recipient,),
+            ).fetchone()
+        return row or (0, 0)
+
+    def rebuild_totals(self):
+        """Recompute the maintained totals from the votes.
+
+        Return how many release and all time totals had drifted.
+        """
+        with self._lock, self.conn:
+            counted = {
+                (release, recipient): (inc, dec)
+                for release, recipient, inc, dec in self.conn.execute(
+                    "SELECT release, recipient, SUM(vote = 1), SUM(vote = -1)"
+                    " FROM votes GROUP BY release, recipient"
+                )
+            }
+            counted_alltime = {}
+            for (release, recipient), (inc, dec) in counted.items():
+                old_inc, old_dec = counted_alltime.get((recipient,), (0, 0))
+                counted_alltime[(recipient,)] = (old_inc + inc, old_dec + dec)
+            drift = _count_drift(
+                self.conn.execute("SELECT release, recipient, inc, dec FROM totals"),
+                counted,
+            ) + _count_drift(
+                self.conn.execute("SELECT recipient, inc, dec FROM alltime_totals"),
+                counted_alltime,
+            )
+            self.conn.execute("DELETE FROM totals")
+            self.conn.executemany(
+                "INSERT INTO totals (release, recipient, inc, dec)"
+                " VALUES (?, ?, ?, ?)",
+                [key + value for key, value in counted.items()],
+            )
+            self.conn.execute("DELETE FROM alltime_totals")
+            self.conn.executemany(
+                "INSERT INTO alltime_totals (recipient, inc, dec) VALUES (?, ?, ?)",
+                [key + value for key, value in counted_alltime.items()],
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('totals', '1')"
+            )
+        return drift
+
+    def import_shelve(self, path, get_current_release):
+        """Copy the votes of a shelve karma db, once.
+
+        Return the number of votes imported, or None if there was nothing to
+        import.
+        """
+        if not dbm.whichdb(path) or self._get_meta("shelve_imported"):
+            return None
+
+        source = ShelveKarmaStore(path, get_current_release)
+        data = source.open()
+        try:
+            rows = [
+                (key.split("-", 1)[1], agent, recipient, vote)
+                for key in data
+                if key.startswith("forwards-")
+                for agent, votes in data[key].items()
+                for recipient, vote in votes.items()
+            ]
+        finally:
+            data.close()
+
+        with self._lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO votes (release, agent, recipient, vote)"
+                " VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self.conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('shelve_imported', ?)",
+                (path,),
+            )
+        self.rebuild_totals()
+        return len(rows)
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+# vim:set shiftwidth=4 tabstop=4 expandtab textwidth=79:
@@ -0,0 +1,86 @@
+###
+# Copyright (c) 2007, Mike McGrath
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+"""
+Fedocal meetings, indexed by time.
+"""
+
+import bisect
+import datetime
+from operator import itemgetter
+
+
+def _parse(date, time):
+    return datetime.datetime.strptime("%s %s" % (date, time), "%Y-%m-%d %H:%M:%S")
+
+
+class Schedule(object):
+    """The meetings of a fedocal calendar or location, sorted by start.
+
+    The start and end of each meeting are parsed once, when the schedule is
+    built.  Meetings starting after a time are then found by bisecting the
+    starts, and meetings going on at a time by bisecting the starts within
+    the longest duration of any meeting before it.
+    """
+
+    def __init__(self, meetings):
+        entries = []
+        for meeting in meetings:
+            start = _parse(meeting["meeting_date"], meeting["meeting_time_start"])
+            end = _parse(
+                meeting.get("meeting_date_end", meeting["meeting_date"]),
+                meeting.get("meeting_time_stop", meeting["meeting_time_start"]),
+            )
+            entries.append((start, end, meeting))
+        entries.sort(key=itemgetter(0))
+        self.starts = [start for start, _, _ in entries]
+        self.ends = [end for _, end, _ in entries]
+        self.meetings = [meeting for _, _, meeting in entries]
+        self.max_duration = max(
+            (end - start for start, end, _ in entries), default=datetime.timedelta(0)
+        )
+
+    def __len__(self):
+        return len(self.meetings)
+
+    def upcoming(self, now):
+        """Yield the (start, meeting) tuples of the meetings after now."""
+        for i in range(bisect.bisect_right(self.starts, now), len(self.starts)):
+            yield self.starts[i], self.meetings[i]
+
+    def ongoing(self, now):
+        """Yield the meetings going on at now."""
+        first = bisect.bisect_left(self.starts, now - self.max_duration)
+        last = bisect.bisect_right(self.starts, now)
+        for i in range(first, last):
+            if now <= self.ends[i]:
+                yield self.meetings[i]
+
+
+# vim:set shiftwidth=4 tabstop=4 expandtab textwidth=79:
@@ -0,0 +1,138 @@
+###
+# Copyright (c) 2007, Mike McGrath
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+"""
+Local index of the Fedora packages, loaded from bulk metadata dumps.
+"""
+
+import bisect
+import difflib
+import json
+import sqlite3
+from contextlib import closing
+
+# Minimum similarity for a package name to be suggested for a misspelled one
+SUGGEST_CUTOFF = 0.75
+
+
+def _source_name(sourcerpm):
+    # name-version-release.src.rpm
+    return sourcerpm.rsplit("-", 2)[0]
+
+
+def load_summaries(path):
+    """Read the summaries of the source packages from a primary.sqlite.
+
+    Both the metadata of source and of binary repositories work: binary
+    packages are grouped by source package, which gets the summary of the
+    binary package of the same name if there is one.
+    """
+    summaries = {}
+    with closing(sqlite3.connect("file:%s?mode=ro" % path, uri=True)) as db:
+        rows = db.execute("SELECT name, summary, rpm_sourcerpm FROM packages")
+        for name, summary, sourcerpm in rows:
+            source = _source_name(sourcerpm) if sourcerpm else name
+            if source == name:
+                summaries[source] = summary
+            else:
+                summaries.setdefault(source, summary)
+    return summaries
+
+
+def load_access(path):
+    """Read the access lists of the packages from a dist-git ACL dump.
+
+    The dump is a JSON object mapping the names of the rpms to the
+    ``access_users`` of their dist-git project, under an ``rpms`` key.
+    """
+    with open(path) as f:
+        return json.load(f)["rpms"]
+
+
+class PackageIndex(object):
+    """Summaries and access lists of the packages, by name.
+
+    Like the account cache, an index is never updated: a reload builds a
+    new one, which replaces the old one by rebinding a single attribute.
+    """
+
+    def __init__(self, summaries=None, access=None, timestamp=None):
+        self.summaries = summaries or {}
+        self.access = access or {}
+        self.timestamp = timestamp
+        self.names = sorted(set(self.summaries) | set(self.access))
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.summaries or name in self.access
+
+    def summary(self, name):
+        """Return the summary of a package, or None."""
+        return self.summaries.get(name)
+
+    def owners(self, name):
+        """Return the access lists of a package, or None."""
+        return self.access.get(name)
+
+    def with_prefix(self, prefix, limit):
+        """Return the first ``limit`` package names starting with prefix."""
+        names = []
+        for i in range(bisect.bisect_left(self.names, prefix), len(self.names)):
+            name = self.names[i]
+            if not name.startswith(prefix) or len(names) == limit:
+                break
+            names.append(name)
+        return names
+
+    def suggest(self, name, limit):
+        """Return at most ``limit`` package names close to a misspelled one.
+
+        Names extending the misspelled one come first, then the most similar
+        ones.
+        """
+        suggestions = self.with_prefix(name, limit)
+        for close in difflib.get_close_matches(
+            name, self.names, n=limit, cutoff=SUGGEST_CUTOFF
+        ):
+            if len(suggestions) == limit:
+                break
+            if close not in suggestions:
+                suggestions.append(close)
+        return suggestions
+
+    def stats(self):
+        return "packages: %i summaries, %i access lists" % (
+            len(self.summaries),
+            len(self.access),
+        )
+
+
+# vim:set shiftwidth=4 tabstop=4 expandtab textwidth=79:
@@ -29,11 +29,15 @@
 ###
 
 import arrow
-import copy
+import functools
+import heapq
+import itertools
 import sgmllib
-import shelve
 import html.entities
-import requests
+import os
+import random
+import resource
+import threading
 import time
 
 # Use re2 if present.  It is faster.
@@ -46,8 +50,9 @@ import supybot.utils as utils
 import supybot.conf as conf
 import supybot.callbacks as callbacks
 import supybot.ircutils as ircutils
+import supybot.schedule as schedule
 import supybot.world as world
-from supybot.commands import wrap
+from supybot.commands import many, wrap
 
 from fedora.client import AppError, AuthError
 from fedora.client.fas2 import AccountSystem
@@ -63,42 +68,115 @@ import simplejson
 import urllib.request
 import urllib.parse
 import urllib.error
-import socket
 import pytz
 import datetime
 import yaml
 
-from itertools import chain
+from concurrent.futures import FIRST_COMPLETED, Future, TimeoutError, wait
 from operator import itemgetter
 
-SPARKLINE_RESOLUTION = 50
-
-datagrepper_url = "https://apps.fedoraproject.org/datagrepper/raw"
+from .accounts import AccountCache, load_snapshot, save_snapshot
+from .caches import BucketCache, CachedValue, ResponseCache
+from .karmadb import ShelveKarmaStore, SQLiteKarmaStore
+from .meetings import Schedule
+from .packages import PackageIndex, load_access, load_summaries
+from .webclient import Deadline, ETagCache, HTTPClient
+from .workers import WorkerPool
 
+SPARKLINE_RESOLUTION = 50
 
-def cmp(a, b):
-    return (a > b) - (a < b)
+# The largest page of messages datagrepper returns
+DATAGREPPER_PAGE_SIZE = 100
 
+# Seconds after which msgs are assumed to all have reached datagrepper, and
+# their counts can be cached
+DATAGREPPER_SETTLE_TIME = 300
 
-def datagrepper_query(kwargs):
-    """Return the count of msgs filtered by kwargs for a given time.
+datagrepper_url = "https://apps.fedoraproject.org/datagrepper/raw"
 
-    The arguments for this are a little clumsy; this is imposed on us by
-    multiprocessing.Pool.
+# The fedmsg categories the quote command knows about, they used to come from
+# the processors of fedmsg.meta, which is no longer loaded.
+QUOTE_CATEGORIES = (
+    "anitya",
+    "ansible",
+    "askbot",
+    "bodhi",
+    "bugzilla",
+    "buildsys",
+    "compose",
+    "copr",
+    "fas",
+    "fedbadges",
+    "fedimg",
+    "fedocal",
+    "fedoratagger",
+    "fmn",
+    "git",
+    "github",
+    "hotness",
+    "jenkins",
+    "kerneltest",
+    "koschei",
+    "mailman",
+    "mdapi",
+    "meetbot",
+    "nuancier",
+    "pagure",
+    "pkgdb",
+    "planet",
+    "summershum",
+    "trac",
+    "wiki",
+    "zanata",
+)
+
+# Only plain data is ever read from YAML, use libyaml when available
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+def datagrepper_query(http, params):
+    """Return the count of msgs filtered by params for a given time.
+
+    The start and end of the time are given as Unix timestamps.
     """
-    start, end = kwargs.pop("start"), kwargs.pop("end")
-    params = {
-        "start": time.mktime(start.timetuple()),
-        "end": time.mktime(end.timetuple()),
-    }
-    params.update(kwargs)
-
-    req = requests.get(datagrepper_url, params=params)
+    req = http.get("datagrepper", datagrepper_url, params=params)
     json_out = simplejson.loads(req.text)
     result = int(json_out["total"])
     return result
 
 
+def datagrepper_page(http, params, page):
+    """Return a page of the msgs filtered by params, oldest first."""
+    params = dict(params, page=page, rows_per_page=DATAGREPPER_PAGE_SIZE, order="asc")
+    req = http.get("datagrepper", datagrepper_url, params=params)
+    return simplejson.loads(req.text)
+
+
+def message_timestamp(message):
+    """Return when a datagrepper message was sent, as a Unix timestamp."""
+    if "timestamp" in message:
+        return float(message["timestamp"])
+    return arrow.get(message["headers"]["sent-at"]).float_timestamp
+
+
+def histogram(timestamps, start, end, buckets):
+    """Count the timestamps falling in each of as many slices of start to end."""
+    width = (end - start) / buckets
+    counts = [0] * buckets
+    for timestamp in timestamps:
+        index = int((timestamp - start) // width)
+        if 0 <= index < buckets:
+            counts[index] += 1
+    return counts
+
+
+def peak_rss():
+    """Describe the memory high-water mark of the bot process."""
+    # ru_maxrss is in kilobytes on Linux
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return "peak RSS %.1f MiB" % (maxrss / 1024.0)
+
+
 def get_ircnicks(user):
     """Extract the IRC nick from the IPA format.
 
@@ -121,39 +199,6 @@ def get_ircnicks(user):
     ]
 
 
-class WorkerThread(world.SupyThread):
-    """A simple worker thread for our threadpool."""
-
-    def __init__(self, fn, item, *args, **kwargs):
-        self.fn = fn
-        self.item = item
-        super(WorkerThread, self).__init__(*args, **kwargs)
-
-    def run(self):
-        self.result = self.fn(self.item)
-
-
-class ThreadPool(object):
-    """Our very own threadpool implementation.
-
-    We make our own thing because multiprocessing is too heavy.
-    """
-
-    def map(self, fn, items):
-        threads = []
-
-        for item in items:
-            threads.append(WorkerThread(fn=fn, item=item))
-
-        for thread in threads:
-            thread.start()
-
-        for thread in threads:
-            thread.join()
-
-        return [thread.result for thread in threads]
-
-
 class Title(sgmllib.SGMLParser):
     entitydefs = html.entities.entitydefs.copy()
     entitydefs["nbsp"] = " "
@@ -190,11 +235,11 @@ class Fedora(callbacks.Plugin):
     def __init__(self, irc):
         super(Fedora, self).__init__(irc)
 
-        # caches, automatically downloaded on __init__, manually refreshed on
-        # .refresh
-        self.users = None
-        self.faslist = None
-        self.nickmap = None
+        # caches, automatically downloaded on __init__, refreshed periodically
+        # and manually on .refresh
+        self.accounts = AccountCache()
+        self.sync_stats = None
+        self._refresh_lock = threading.Lock()
 
         # To get the information, we need a username and password to FAS.
         # DO NOT COMMIT YOUR USERNAME AND PASSWORD TO THE PUBLIC REPOSITORY!
@@ -223,116 +268,367 @@ class Fedora(callbacks.Plugin):
         # self.url = {}
 
         self.github_oauth_token = self.registryValue("github.oauth_token")
+        self.github_etags = ETagCache(self.registryValue("github.etag_cache_size"))
 
         self.karma_tokens = ("++", "--") if self.allow_negative else ("++",)
 
         self.fedocal_url = self.registryValue("fedocal_url")
 
-        # fetch necessary caches
+        self.http = HTTPClient(
+            lambda service: self.registryValue("http.timeouts." + service),
+            connect_timeout=self.registryValue("http.connect_timeout"),
+            retries=self.registryValue("http.retries"),
+            pool_size=self.registryValue("http.pool_size"),
+        )
+        self.workers = WorkerPool("workers", self.registryValue("workers.size"))
+        self._karma_store = None
+        self._karma_store_lock = threading.Lock()
+        self.release_cache = CachedValue(
+            "current release",
+            self._fetch_current_release,
+            ttl=self.registryValue("karma.release_ttl"),
+            workers=self.workers,
+        )
+        self.responses = ResponseCache(
+            "responses",
+            size=self.registryValue("cache.size"),
+            stale_ttl=self.registryValue("cache.stale_ttl"),
+            negative_ttl=self.registryValue("cache.negative_ttl"),
+            workers=self.workers,
+        )
+        self.sparkline_buckets = BucketCache(
+            "sparklines", self.registryValue("quote.cache_max_age")
+        )
+
+        # local package index, read from the dumps on disk when configured and
+        # reloaded when they change
+        self.packages = PackageIndex()
+        self._package_mtimes = None
+        self._reload_packages()
+        self._schedule_package_reload()
+
+        # fetch necessary caches, starting from the on-disk snapshot if there
+        # is a recent enough one
         if self.registryValue("fasjson.refresh_cache_on_startup"):
-            self._refresh()
+            if self._load_snapshot():
+                self._refresh_in_background()
+            else:
+                self._refresh()
+        self._schedule_refresh()
 
         # Pull in /etc/fedmsg.d/ so we can build the fedmsg.meta processors.
         # fm_config = fedmsg.config.load_config()
         # fedmsg.meta.make_processors(**fm_config)
 
+    def die(self):
+        for event in ("Fedora.refresh", "Fedora.packages"):
+            try:
+                schedule.removeEvent(event)
+            except KeyError:
+                pass
+        with self._karma_store_lock:
+            if self._karma_store is not None:
+                self._karma_store.close()
+                self._karma_store = None
+        self.workers.shutdown()
+        self.http.close()
+        super(Fedora, self).die()
+
     def _refresh(self):
-        self.log.info("Downloading user data")
+        with self._refresh_lock:
+            self._rebuild_caches()
 
-        if self.registryValue("use_fasjson"):
-            self.log.info("Caching necessary user data")
-            self.users = []
-            self.faslist = {}
-            self.nickmap = {}
-            for user in self.fasjsonclient.list_users().result:
-                name = user["username"]
-                self.users.append(name)
-                nicks = get_ircnicks(user)
-                key = " ".join(
-                    [
-                        user["username"],
-                        user["emails"][0],
-                        user["human_name"] or "",
-                        nicks[0] if nicks else "",
-                    ]
-                )
-                value = "%s '%s' <%s>" % (
+    def _refresh_in_background(self):
+        """Refresh the caches in a background thread.
+
+        Return False if a refresh is already running, in which case this
+        request just merges into it.
+        """
+        if not self._refresh_lock.acquire(blocking=False):
+            return False
+
+        def target():
+            try:
+                self._rebuild_caches()
+            except Exception:
+                self.log.exception("Could not refresh the caches")
+            finally:
+                self._refresh_lock.release()
+
+        world.SupyThread(
+            target=target, name="Fedora cache refresh", daemon=True
+        ).start()
+        return True
+
+    def _schedule_refresh(self):
+        interval = self.registryValue("fasjson.refresh_interval")
+        if not interval:
+            return
+        jitter = random.uniform(0, self.registryValue("fasjson.refresh_jitter"))
+
+        def scheduled_refresh():
+            self._refresh_in_background()
+            self._schedule_refresh()
+
+        schedule.addEvent(
+            scheduled_refresh, time.time() + interval + jitter, "Fedora.refresh"
+        )
+
+    def _reload_packages(self):
+        """Load the package dumps again if they changed on disk."""
+        primary_db = self.registryValue("packages.primary_db")
+        acl_dump = self.registryValue("packages.acl_dump")
+        try:
+            mtimes = tuple(
+                os.stat(path).st_mtime if path else None
+                for path in (primary_db, acl_dump)
+            )
+            if mtimes == self._package_mtimes:
+                return
+            start = time.time()
+            summaries = load_summaries(primary_db) if primary_db else {}
+            access = load_access(acl_dump) if acl_dump else {}
+        except Exception:
+            self.log.exception("Could not load the package dumps")
+            return
+        self.packages = PackageIndex(summaries, access, timestamp=time.time())
+        self._package_mtimes = mtimes
+        if self.packages:
+            self.log.info(
+                "Loaded %i packages in %.2fs", len(self.packages), time.time() - start
+            )
+
+    def _schedule_package_reload(self):
+        interval = self.registryValue("packages.refresh_interval")
+        if not interval:
+            return
+        schedule.addPeriodicEvent(
+            lambda: self.workers.submit(self._reload_packages),
+            interval,
+            "Fedora.packages",
+            now=False,
+        )
+
+    def _did_you_mean(self, package):
+        limit = self.registryValue("packages.suggestions")
+        suggestions = self.packages.suggest(package, limit) if limit else []
+        if not suggestions:
+            return ""
+        return " Did you mean %s?" % ", ".join(suggestions)
+
+    def _iter_fasjson_pages(self):
+        """Yield the FASJSON users, one page at a time."""
+        page_size = self.registryValue("fasjson.page_size")
+        page_number = 1
+        while True:
+            response = self.fasjsonclient.list_users(
+                page_size=page_size, page_number=page_number
+            )
+            yield response.result
+            if not response.page or page_number >= response.page["total_pages"]:
+                return
+            page_number += 1
+
+    def _sync_accounts(self):
+        """Update the user cache with what changed in FASJSON.
+
+        The changes are applied to a copy of the cache, which then replaces
+        it, so readers never see a half applied sync.
+        """
+        start = time.time()
+        accounts = self.accounts.copy()
+        pages = added = changed = 0
+        seen = set()
+        for page in self._iter_fasjson_pages():
+            pages += 1
+            for user in page:
+                seen.add(user["username"])
+                result = accounts.update(
                     user["username"],
-                    user["human_name"] or "",
-                    user["emails"][0] or "",
+                    user["human_name"],
+                    user["emails"][0],
+                    get_ircnicks(user),
                 )
-                self.faslist[key] = value
-                for nick in nicks:
-                    self.nickmap[nick] = name
+                if result == "added":
+                    added += 1
+                elif result == "changed":
+                    changed += 1
+        if not seen:
+            # Rather keep a stale cache than wipe it on a FASJSON hiccup.
+            self.log.warning("FASJSON returned no users, not syncing the cache")
+            return
+        removed = [name for name in accounts.uids if name not in seen]
+        for name in removed:
+            accounts.remove(name)
+        accounts.timestamp = time.time()
+
+        # Updates leave dead entries behind in the search index, rebuild it
+        # once they make up a good part of it.
+        if accounts.deleted > len(accounts) / 4:
+            accounts = accounts.compacted()
+        self.accounts = accounts
+
+        self.sync_stats = (
+            "synced %i pages: %i added, %i changed, %i removed in %.1fs, %s"
+            % (pages, added, changed, len(removed), time.time() - start, peak_rss())
+        )
+        self.log.info("User cache %s" % self.sync_stats)
+
+    def _rebuild_caches(self):
+        if self.registryValue("use_fasjson") and (
+            self.registryValue("fasjson.incremental_sync")
+            and self.accounts.timestamp is not None
+        ):
+            self._sync_accounts()
+            self._save_snapshot()
+            return
+
+        self.log.info("Downloading user data")
+        start = time.time()
+        accounts = AccountCache(timestamp=time.time())
+        if self.registryValue("use_fasjson"):
+            self.log.info("Caching necessary user data")
+            # Index the users page by page so that only one page of raw
+            # records is held in memory at a time.
+            for page in self._iter_fasjson_pages():
+                for user in page:
+                    nicks = get_ircnicks(user)
+                    accounts.add(
+                        user["username"], user["human_name"], user["emails"][0], nicks
+                    )
         else:
             # leave this untouched for now, will remove when FAS finally disappears
-            timeout = socket.getdefaulttimeout()
-            socket.setdefaulttimeout(None)
             try:
                 request = self.fasclient.send_request(
                     "/user/list", req_params={"search": "*"}, auth=True, timeout=240
                 )
-                users = request["people"] + request["unapproved_people"]
+                people = request["people"] + request["unapproved_people"]
                 del request
             except AuthError:
                 self.log.info("Error Authorizing to FAS")
-                users = []
+                people = []
 
             self.log.info("Caching necessary user data")
-            self.users = {}
-            self.faslist = {}
-            self.nickmap = {}
-            for user in users:
-                name = user["username"]
-                self.users[name] = {}
-                self.users[name]["id"] = user["id"]
-                key = " ".join(
-                    [
-                        user["username"],
-                        user["email"] or "",
-                        user["human_name"] or "",
-                        user["ircnick"] or "",
-                    ]
-                )
-                key = key.lower()
-                value = "%s '%s' <%s>" % (
-                    user["username"],
-                    user["human_name"] or "",
-                    user["email"] or "",
-                )
-                self.faslist[key] = value
-                if user["ircnick"]:
-                    self.nickmap[user["ircnick"]] = name
+            for user in people:
+                nicks = [user["ircnick"]] if user["ircnick"] else []
+                accounts.add(user["username"], user["human_name"], user["email"], nicks)
+
+        self.accounts = accounts
+        self.sync_stats = "downloaded %i users in %.1fs, %s" % (
+            len(accounts),
+            time.time() - start,
+            peak_rss(),
+        )
+        self.log.info("User cache %s" % self.sync_stats)
+        self._save_snapshot()
+
+    def _snapshot_path(self):
+        path = self.registryValue("fasjson.snapshot_path")
+        if path and not os.path.isabs(path):
+            path = os.path.join(conf.supybot.directories.data(), path)
+        return path
+
+    def _load_snapshot(self):
+        path = self._snapshot_path()
+        if not path:
+            return False
+        try:
+            snapshot = load_snapshot(
+                path, self.registryValue("fasjson.snapshot_max_age")
+            )
+        except Exception as e:
+            self.log.warning("Could not load the user cache snapshot: %s" % e)
+            return False
+        if snapshot is None:
+            return False
+        self.accounts = snapshot
+        self.log.info(
+            "Loaded %i users from the snapshot taken %s"
+            % (len(snapshot), arrow.get(snapshot.timestamp).humanize())
+        )
+        return True
 
-            socket.setdefaulttimeout(timeout)
+    def _save_snapshot(self):
+        path = self._snapshot_path()
+        if not path:
+            return
+        try:
+            save_snapshot(path, self.accounts)
+        except Exception as e:
+            self.log.warning("Could not save the user cache snapshot: %s" % e)
 
     def _get_person_by_username(self, irc, username):
         """looks up a user by the username"""
-        if self.registryValue("use_fasjson"):
-            try:
-                person = self.fasjsonclient.get_user(username=username).result
-            except fasjson_client.errors.APIError as e:
-                if e.code == 404:
-                    irc.reply(f"Sorry, but user '{username}' does not exist")
-                    return
-                else:
-                    irc.reply("Something blew up, please try again")
-                    self.log.error(e)
-                    return
-        else:
-            try:
-                person = self.fasclient.person_by_username(username)
-                # convert to the newer FASJSON way for now
-                if person.get("email"):
-                    person["emails"] = [person["email"]]
-            except Exception as e:
-                irc.reply("Something blew up, please try again")
-                self.log.error(e)
-                return
-            if not person:
-                irc.reply(f"Sorry, but user '{username}' does not exist")
-                return
+        return self._person_or_reply(
+            irc, username, functools.partial(self._lookup_person, username)
+        )
 
+    def _get_people(self, irc, usernames, from_cache=False):
+        """Look up users by their usernames, all at the same time.
+
+        Return the persons found, in the order of the usernames, or none if
+        there are more usernames than workers.max_batch.  With from_cache, the
+        users in the user cache are not looked up if it is fresh enough, their
+        persons only have a username, human_name and emails.
+        """
+        if self._too_many(irc, usernames, "usernames"):
+            return []
+        accounts = self.accounts
+        freshness = self.registryValue("fasjson.cache_freshness")
+        if accounts.timestamp is None or time.time() - accounts.timestamp > freshness:
+            from_cache = False
+        lookups = []
+        for username in usernames:
+            account = accounts.get(username) if from_cache else None
+            if account is None:
+                lookup = self.workers.submit(self._lookup_person, username)
+            else:
+                lookup = Future()
+                lookup.set_result(
+                    {
+                        "username": account.username,
+                        "human_name": account.human_name,
+                        "emails": [account.email],
+                    }
+                )
+            lookups.append((username, lookup))
+        people = []
+        for username, lookup in lookups:
+            person = self._person_or_reply(irc, username, lookup.result)
+            if person:
+                people.append(person)
+        return people
+
+    def _person_or_reply(self, irc, username, lookup):
+        """Return the person lookup() finds, replying if there is none."""
+        try:
+            person = lookup()
+        except Exception as e:
+            irc.reply("Something blew up, please try again")
+            self.log.error(e)
+            return None
+        if not person:
+            irc.reply(f"Sorry, but user '{username}' does not exist")
+        return person
+
+    def _lookup_person(self, username):
+        """Return the person with a username, or None if there is none.
+
+        FASJSON has no way to get several users at once, so the lookups are
+        rather cached, and the concurrent ones of a username coalesced.
+        """
+        if self.registryValue("use_fasjson"):
+            return self._cached(
+                "users",
+                ("get_user", username),
+                functools.partial(
+                    self._fasjson_lookup, self.fasjsonclient.get_user, username=username
+                ),
+            )
+        person = self.fasclient.person_by_username(username)
+        # convert to the newer FASJSON way for now
+        if person and person.get("email"):
+            person["emails"] = [person["email"]]
         return person
 
     def refresh(self, irc, msg, args):
@@ -340,12 +636,57 @@ class Fedora(callbacks.Plugin):
 
         Refresh the necessary caches."""
 
-        irc.reply("Downloading caches.  This could take a while...")
-        self._refresh()
-        irc.replySuccess()
+        if self._refresh_in_background():
+            irc.reply(
+                "Downloading caches in the background.  This could take a while..."
+            )
+        else:
+            irc.reply("The caches are already being refreshed.")
 
     refresh = wrap(refresh)
 
+    def cachestats(self, irc, msg, args):
+        """takes no arguments
+
+        Report the age and hit rate of the plugin caches."""
+        accounts = self.accounts
+        if accounts.timestamp is None:
+            stats = ["users: empty"]
+        else:
+            stats = [
+                "users: %i accounts, refreshed %s (last %s)"
+                % (
+                    len(accounts),
+                    arrow.get(accounts.timestamp).humanize(),
+                    self.sync_stats or "loaded from the snapshot",
+                )
+            ]
+        stats.append(self.release_cache.stats())
+        stats.append(self.responses.stats())
+        stats.append(self.github_etags.stats("github"))
+        stats.append(self.sparkline_buckets.stats())
+        stats.append(self.packages.stats())
+        irc.reply("; ".join(stats))
+
+    cachestats = wrap(cachestats)
+
+    def httpstats(self, irc, msg, args):
+        """takes no arguments
+
+        Report the number and duration of the requests made to each remote
+        service, and the load of the worker pool."""
+        replies = []
+        for service, s in sorted(self.http.stats.items()):
+            rate_limit = self.http.rate_limits.get(service)
+            if rate_limit is None:
+                replies.append("%s: %s" % (service, s))
+            else:
+                replies.append("%s: %s, %s" % (service, s, rate_limit))
+        irc.reply("; ".join(replies) or "No requests made yet.")
+        irc.reply(self.workers.stats())
+
+    httpstats = wrap(httpstats)
+
     @property
     def karma_db_path(self):
         return self.registryValue("karma.db_path")
@@ -358,14 +699,26 @@ class Fedora(callbacks.Plugin):
     def allow_negative(self):
         return self.registryValue("karma.allow_negative")
 
-    def _load_json(self, url):
-        timeout = socket.getdefaulttimeout()
-        socket.setdefaulttimeout(45)
+    def _load_json(self, service, url):
+        return simplejson.loads(self.http.get(service, url).text)
+
+    def _cached(self, command, key, fetch):
+        """Look a (service, argument) key up in the response cache.
+
+        fetch() is called on a miss, and should return None if what is looked
+        up does not exist.
+        """
+        ttl = self.registryValue("cache.ttl." + command)
+        return self.responses.get(key, fetch, ttl)
+
+    def _fasjson_lookup(self, method, **kwargs):
+        """Return the result of a FASJSON call, or None if it gets a 404."""
         try:
-            json = simplejson.loads(utils.web.getUrl(url))
-        finally:
-            socket.setdefaulttimeout(timeout)
-        return json
+            return method(**kwargs).result
+        except fasjson_client.errors.APIError as e:
+            if e.code == 404:
+                return None
+            raise
 
     def pulls(self, irc, msg, args, slug):
         """<username[/repo]>
@@ -379,121 +732,219 @@ class Fedora(callbacks.Plugin):
             return
 
         irc.reply("One moment, please...  Looking up %s." % slug)
-        fail_on_github, fail_on_pagure = False, False
-        github_repos, pagure_repos = [], []
-        try:
-            github_repos = list(self.yield_github_repos(slug))
-        except IOError as e:
-            self.log.exception(e.message)
-            fail_on_github = True
-
-        try:
-            pagure_repos = list(self.yield_pagure_repos(slug))
-        except IOError as e:
-            self.log.exception(e.message)
-            fail_on_pagure = True
+        n = 6  # Show 6 pull requests
+        deadline = Deadline(self.registryValue("http.command_deadline"))
+        newest, total, unreachable, complete = self._newest_pulls(slug, n, deadline)
 
-        if fail_on_github and fail_on_pagure:
+        if len(unreachable) == 2:
             irc.reply("Could not find %s on GitHub or pagure.io" % slug)
             return
 
-        results = sum(
-            [list(self.yield_github_pulls(slug, r)) for r in github_repos], []
-        ) + sum([list(self.yield_pagure_pulls(slug, r)) for r in pagure_repos], [])
-
-        # Reverse-sort by time (newest-first)
-        comparator = lambda a, b: cmp(b["age_numeric"], a["age_numeric"])  # noqa: E731
-        results.sort(comparator)
-
-        if not results:
-            irc.reply("No pending pull requests on {slug}".format(slug=slug))
+        if not newest:
+            if complete:
+                irc.reply("No pending pull requests on {slug}".format(slug=slug))
         else:
-            n = 6  # Show 6 pull requests
-            for pull in results[:n]:
+            for pull in newest:
                 irc.reply(
                     '@{user}\'s "{title}" {url} filed {age}'.format(
                         user=pull["user"],
                         title=pull["title"],
                         url=pull["url"],
                         age=pull["age"],
-                    ).encode("utf-8")
+                    )
                 )
 
-            if len(results) > n:
-                irc.reply("... and %i more." % (len(results) - n))
+            if total > n:
+                irc.reply("... and %i more." % (total - n))
+
+        if not complete:
+            irc.reply("Some repos took too long to answer, the list may be incomplete.")
 
     pulls = wrap(pulls, ["text"])
 
-    def yield_github_repos(self, username):
+    def _newest_pulls(self, slug, n, deadline):
+        """Find the n newest pull requests of an org/username or tag.
+
+        The repos of GitHub and pagure.io are listed, and then the n newest
+        pull requests of each fetched, in the worker pool.  As they come in,
+        they are pushed into a heap of the n newest ones seen so far, so that
+        whatever was found by the deadline can still be returned.
+
+        Return a tuple of the newest pull requests, newest first, the total
+        number of pull requests, the forges which the repos could not be
+        listed from, and whether all of it was fetched before the deadline.
+        """
+        newest_pulls = {
+            "GitHub": self.github_newest_pulls,
+            "pagure.io": self.pagure_newest_pulls,
+        }
+        pending = {
+            self.workers.submit(list, self.yield_github_repos(slug, deadline)): (
+                "GitHub",
+                None,
+            ),
+            self.workers.submit(list, self.yield_pagure_repos(slug, deadline)): (
+                "pagure.io",
+                None,
+            ),
+        }
+        newest, total, unreachable = [], 0, []
+        tiebreak = itertools.count()
+        try:
+            while pending:
+                done, _ = wait(
+                    pending,
+                    timeout=max(deadline.remaining(), 0),
+                    return_when=FIRST_COMPLETED,
+                )
+                if not done:
+                    break
+                for future in done:
+                    forge, repo = pending.pop(future)
+                    try:
+                        results = future.result()
+                    except (IOError, ValueError) as e:
+                        self.log.warning(
+                            "Could not list %s on %s: %s", repo or "the repos", forge, e
+                        )
+                        if repo is None:
+                            unreachable.append(forge)
+                        continue
+                    if repo is None:
+                        for name in results:
+                            task = self.workers.submit(
+                                newest_pulls[forge], slug, name, n, deadline
+                            )
+                            pending[task] = (forge, name)
+                        continue
+                    pulls, count = results
+                    total += count
+                    for pull in pulls:
+                        entry = (pull["age_numeric"], next(tiebreak), pull)
+                        if len(newest) < n:
+                            heapq.heappush(newest, entry)
+                        else:
+                            heapq.heappushpop(newest, entry)
+        finally:
+            for future in pending:
+                future.cancel()
+        newest = [pull for _, _, pull in sorted(newest, reverse=True)]
+        return newest, total, unreachable, not pending
+
+    def yield_github_repos(self, username, deadline=None):
         self.log.info("Finding github repos for %r" % username)
         tmpl = "https://api.github.com/users/{username}/repos?per_page=100"
         url = tmpl.format(username=username)
-        auth = dict(access_token=self.github_oauth_token)
-        for result in self.yield_github_results(url, auth):
+        for result in self.yield_github_results(url, deadline):
             yield result["name"]
 
-    def yield_github_pulls(self, username, repo):
+    def github_newest_pulls(self, username, repo, n, deadline=None):
+        """Return the n newest pull requests of a GitHub repo, and their count.
+
+        GitHub sorts them for us, so only the first page is needed, and the
+        last one to count them if there are more.
+        """
         self.log.info("Finding github pull requests for %r %r" % (username, repo))
-        tmpl = "https://api.github.com/repos/{username}/{repo}/pulls?per_page=100"
+        tmpl = (
+            "https://api.github.com/repos/{username}/{repo}/pulls"
+            "?sort=created&direction=desc&per_page=100"
+        )
         url = tmpl.format(username=username, repo=repo)
-        auth = dict(access_token=self.github_oauth_token)
-        for result in self.yield_github_results(url, auth):
-            yield dict(
+        results, link = self._github_page(url, deadline)
+        total = len(results)
+        if "last" in link:
+            last, _ = self._github_page(link["last"], deadline)
+            query = urllib.parse.urlparse(link["last"]).query
+            pages = int(urllib.parse.parse_qs(query)["page"][0])
+            total = (pages - 1) * len(results) + len(last)
+        pulls = [
+            dict(
                 user=result["user"]["login"],
                 title=result["title"],
                 url=result["html_url"],
                 age=arrow.get(result["created_at"]).humanize(),
                 age_numeric=arrow.get(result["created_at"]),
             )
+            for result in results[:n]
+        ]
+        return pulls, total
 
-    def yield_github_results(self, url, auth):
-        results = []
+    def yield_github_results(self, url, deadline=None):
         link = dict(next=url)
         while "next" in link:
-            response = requests.get(link["next"], params=auth)
+            results, link = self._github_page(link["next"], deadline)
+            for result in results:
+                yield result
 
-            if response.status_code == 404:
-                raise IOError("404 for %r" % link["next"])
+    def _github_page(self, url, deadline=None):
+        """Return the results in a page of the GitHub API, and its links."""
+        response = self._github_get(url, deadline)
 
-            # And.. if we didn't get good results, just bail.
-            if response.status_code != 200:
-                raise IOError(
-                    "Non-200 status code %r; %r; %r"
-                    % (response.status_code, link["next"], response.json)
-                )
+        if response.status_code == 404:
+            raise IOError("404 for %r" % url)
 
-            results = response.json()
+        # And.. if we didn't get good results, just bail.
+        if response.status_code != 200:
+            raise IOError(
+                "Non-200 status code %r; %r; %r"
+                % (response.status_code, url, response.text)
+            )
 
-            for result in results:
-                yield result
+        field = response.headers.get("link", None)
+
+        link = dict()
+        if field:
+            link = dict(
+                [
+                    (
+                        part.split("; ")[1][5:-1],
+                        part.split("; ")[0][1:-1],
+                    )
+                    for part in field.split(", ")
+                ]
+            )
+        return response.json(), link
 
-            field = response.headers.get("link", None)
+    def _github_get(self, url, deadline=None):
+        """GET from the GitHub API, revalidating the responses we have.
 
-            link = dict()
-            if field:
-                link = dict(
-                    [
-                        (
-                            part.split("; ")[1][5:-1],
-                            part.split("; ")[0][1:-1],
-                        )
-                        for part in field.split(", ")
-                    ]
-                )
+        Unchanged responses do not count against the rate limit.  When it is
+        about to run out, what we have is served without revalidating it, and
+        nothing else is requested until the limit is reset.
+        """
+        rate_limit = self.http.rate_limits.get("github")
+        reserve = self.registryValue("github.rate_limit_reserve")
+        if rate_limit is not None and rate_limit.nearly_exhausted(reserve):
+            response = self.github_etags.response(url)
+            if response is None:
+                raise IOError("GitHub rate limit nearly exhausted: %s" % rate_limit)
+            return response
+        headers = {}
+        if self.github_oauth_token:
+            headers["Authorization"] = "token " + self.github_oauth_token
+        return self.http.get_cached(
+            "github", url, self.github_etags, headers=headers, deadline=deadline
+        )
 
-    def yield_pagure_repos(self, tag):
+    def yield_pagure_repos(self, tag, deadline=None):
         self.log.info("Finding pagure repos for %r" % tag)
         tmpl = "https://pagure.io/api/0/projects?tags={tag}"
         url = tmpl.format(tag=tag)
-        for result in self.yield_pagure_results(url, "projects"):
+        for result in self.yield_pagure_results(url, "projects", deadline):
             yield result["name"]
 
-    def yield_pagure_pulls(self, tag, repo):
+    def pagure_newest_pulls(self, tag, repo, n, deadline=None):
+        """Return the n newest pull requests of a pagure repo, and their count.
+
+        pagure returns the newest first, along with their total count, so
+        only the first page is needed.
+        """
         self.log.info("Finding pagure pull requests for %r %r" % (tag, repo))
-        tmpl = "https://pagure.io/api/0/{repo}/pull-requests"
-        url = tmpl.format(tag=tag, repo=repo)
-        for result in self.yield_pagure_results(url, "requests"):
-            yield dict(
+        tmpl = "https://pagure.io/api/0/{repo}/pull-requests?per_page={n}"
+        url = tmpl.format(repo=repo, n=n)
+        results = self._pagure_json(url, deadline)
+        pulls = [
+            dict(
                 user=result["user"]["name"],
                 title=result["title"],
                 url="https://pagure.io/{repo}/pull-request/{id}".format(
@@ -502,9 +953,16 @@ class Fedora(callbacks.Plugin):
                 age=arrow.get(result["date_created"]).humanize(),
                 age_numeric=arrow.get(result["date_created"]),
             )
+            for result in results["requests"]
+        ]
+        return pulls, results.get("total_requests", len(pulls))
+
+    def yield_pagure_results(self, url, key, deadline=None):
+        for result in self._pagure_json(url, deadline)[key]:
+            yield result
 
-    def yield_pagure_results(self, url, key):
-        response = requests.get(url)
+    def _pagure_json(self, url, deadline=None):
+        response = self.http.get("pagure", url, deadline=deadline)
 
         if response.status_code == 404:
             raise IOError("404 for %r" % url)
@@ -516,28 +974,68 @@ class Fedora(callbacks.Plugin):
                 % (response.status_code, url, response.text)
             )
 
-        results = response.json()
-        results = results[key]
+        return response.json()
 
-        for result in results:
-            yield result
-
-    def whoowns(self, irc, msg, args, package):
-        """<package>
+    def whoowns(self, irc, msg, args, packages):
+        """<package> [<package> ...]
 
-        Retrieve the owner of a given package
+        Retrieve the owner of the given packages
         """
-        # First use pagure info
-        url = "https://src.fedoraproject.org/api/0/rpms/"
-        req = requests.get(url + package)
-        if req.status_code == 404:
-            irc.reply("Package %s not found." % package)
+        if self._too_many(irc, packages, "packages"):
             return
+        deadline = Deadline(self.registryValue("http.command_deadline"))
+        # Look up pagure info and fedora-scm-requests for all the packages at
+        # once, the latter is only a bonus so it is not waited for past the
+        # deadline.
+        lookups = [
+            (
+                package,
+                self.workers.submit(self._package_access, package, deadline),
+                self.workers.submit(
+                    self._cached,
+                    "whoowns",
+                    ("scm-requests", package),
+                    functools.partial(self._fetch_bugzilla_contacts, package, deadline),
+                ),
+            )
+            for package in packages
+        ]
+        for package, access, contacts in lookups:
+            resp = self._ownership(package, access, contacts, deadline)
+            if len(packages) > 1:
+                resp = "%s: %s" % (ircutils.bold(package), resp)
+            irc.reply(resp)
+
+    whoowns = wrap(whoowns, [many("somethingWithoutSpaces")])
 
-        req_json = req.json()
-        admins = ", ".join(req_json["access_users"]["admin"])
-        owners = ", ".join(req_json["access_users"]["owner"])
-        committers = ", ".join(req_json["access_users"]["commit"])
+    def _too_many(self, irc, names, what):
+        """Reply with an error if a command was given too many names.
+
+        The lookups of all the names are submitted to the workers at once, so
+        their number is capped by workers.max_batch.
+        """
+        max_batch = self.registryValue("workers.max_batch")
+        if len(names) <= max_batch:
+            return False
+        irc.reply("Sorry, I can only look up %i %s at once." % (max_batch, what))
+        return True
+
+    def _ownership(self, package, access, contacts, deadline):
+        """Format the owners of a package from its pending lookups."""
+        try:
+            access = access.result(timeout=deadline.remaining())
+        except (IOError, TimeoutError):
+            self.log.exception("Could not get the owners of %s", package)
+            access.cancel()
+            contacts.cancel()
+            return "Sorry, could not get the owners of %s." % package
+        if access is None:
+            contacts.cancel()
+            return "Package %s not found.%s" % (package, self._did_you_mean(package))
+
+        admins = ", ".join(access["admin"])
+        owners = ", ".join(access["owner"])
+        committers = ", ".join(access["commit"])
 
         if owners:
             owners = ircutils.bold("owner: ") + owners
@@ -548,24 +1046,56 @@ class Fedora(callbacks.Plugin):
 
         resp = "; ".join([x for x in [owners, admins, committers] if x != ""])
 
-        # Then try using fedora-scm-requests for more info
-        url = "https://pagure.io/releng/fedora-scm-requests/raw/master/f/rpms/"
-        req = requests.get(url + package)
-        if req.status_code == 200:
-            try:
-                yml = yaml.load(req.text)
-                if "bugzilla_contact" in yml:
-                    lines = []
-                    for k, v in yml["bugzilla_contact"].items():
-                        lines.append("%s: %s" % (ircutils.bold(k), v))
-                    resp += " - " + "; ".join(lines)
-            except yaml.scanner.ScannerError:
-                # If we can't parse the YAML for some reason, don't worry about
-                # it. Just return the initial response.
-                pass
-        irc.reply(resp)
+        try:
+            contacts = contacts.result(timeout=deadline.remaining())
+        except (IOError, TimeoutError):
+            # The owners are what was asked for, reply with them anyway.
+            self.log.exception("Could not get the scm request of %s", package)
+            contacts.cancel()
+            contacts = None
+        if contacts:
+            lines = []
+            for k, v in contacts.items():
+                lines.append("%s: %s" % (ircutils.bold(k), v))
+            resp += " - " + "; ".join(lines)
+        return resp
+
+    def _package_access(self, package, deadline=None):
+        """Return the access lists of a package, from the index if possible."""
+        access = self.packages.owners(package)
+        if access is None:
+            access = self._cached(
+                "whoowns",
+                ("distgit", package),
+                functools.partial(self._fetch_package_access, package, deadline),
+            )
+        return access
 
-    whoowns = wrap(whoowns, ["text"])
+    def _fetch_package_access(self, package, deadline=None):
+        url = "https://src.fedoraproject.org/api/0/rpms/"
+        req = self.http.get("distgit", url + package, deadline=deadline)
+        if req.status_code == 404:
+            return None
+        if req.status_code != 200:
+            raise IOError("Non-200 status code %r for %r" % (req.status_code, package))
+        return req.json()["access_users"]
+
+    def _fetch_bugzilla_contacts(self, package, deadline=None):
+        url = "https://pagure.io/releng/fedora-scm-requests/raw/master/f/rpms/"
+        req = self.http.get("pagure", url + package, deadline=deadline)
+        if req.status_code == 404:
+            return None
+        if req.status_code != 200:
+            raise IOError("Non-200 status code %r for %r" % (req.status_code, package))
+        try:
+            yml = yaml.load(req.text, Loader=YAML_LOADER)
+        except yaml.YAMLError:
+            # If we can't parse the YAML for some reason, don't worry about
+            # it. Just return the initial response.
+            return None
+        if not isinstance(yml, dict):
+            return None
+        return yml.get("bugzilla_contact")
 
     def wiki(self, irc, msg, args, page_name):
         """<wiki_page>
@@ -584,65 +1114,72 @@ class Fedora(callbacks.Plugin):
 
         Returns a description of a given package.
         """
-        url = "https://apps.fedoraproject.org/mdapi/rawhide/srcpkg/"
-        req = requests.get(url + package)
-        if req.status_code == 404:
-            irc.reply("No such package exists.")
+        summary = self.packages.summary(package)
+        if summary is None:
+            summary = self._cached(
+                "what",
+                ("mdapi", package),
+                functools.partial(self._fetch_summary, package),
+            )
+        if summary is None:
+            irc.reply("No such package exists.%s" % self._did_you_mean(package))
         else:
-            irc.reply("%s: %s" % (package, req.json()["summary"]))
+            irc.reply("%s: %s" % (package, summary))
 
     what = wrap(what, ["text"])
 
+    def _fetch_summary(self, package):
+        url = "https://apps.fedoraproject.org/mdapi/rawhide/srcpkg/"
+        req = self.http.get("mdapi", url + package)
+        if req.status_code == 404:
+            return None
+        return req.json()["summary"]
+
     def fas(self, irc, msg, args, find_name):
         """<query>
 
         Search the Fedora Account System usernames, full names, and email
-        addresses for a match."""
+        addresses for a match.  Queries shorter than 3 characters only match
+        whole usernames and IRC nicks."""
         find_name = to_unicode(find_name)
-        matches = []
-        for entry in self.faslist:
-            if entry.find(find_name.lower()) != -1:
-                matches.append(entry)
-        if len(matches) == 0:
+        limit = self.registryValue("fas.search_limit")
+        matches, total, counted = self.accounts.search(find_name, limit)
+        if total == 0:
             irc.reply("'%s' Not Found!" % find_name)
         else:
-            output = []
-            for match in matches:
-                output.append(self.faslist[match])
-            irc.reply(" - ".join(output).encode("utf-8"))
+            if total > len(matches):
+                more = total - len(matches)
+                if counted:
+                    matches.append("... and %i more." % more)
+                else:
+                    matches.append("... and about %i more." % more)
+            irc.reply(" - ".join(matches))
 
     fas = wrap(fas, ["text"])
 
-    def hellomynameis(self, irc, msg, args, name):
-        """<username>
+    def hellomynameis(self, irc, msg, args, names):
+        """<username> [<username> ...]
 
-        Return brief information about a Fedora Account System username. Useful
+        Return brief information about Fedora Account System usernames. Useful
         for things like meeting roll call and calling attention to yourself."""
 
-        person = self._get_person_by_username(irc, name)
-
-        if not person:
-            return
-
-        irc.reply(
-            f"{person['username']} '{person['human_name']}' <{person['emails'][0]}>"
-        )
+        for person in self._get_people(irc, names, from_cache=True):
+            irc.reply(
+                f"{person['username']} '{person['human_name']}' "
+                f"<{person['emails'][0]}>"
+            )
 
-    hellomynameis = wrap(hellomynameis, ["text"])
+    hellomynameis = wrap(hellomynameis, [many("somethingWithoutSpaces")])
 
-    def himynameis(self, irc, msg, args, name):
-        """<username>
+    def himynameis(self, irc, msg, args, names):
+        """<username> [<username> ...]
 
         Will the real Slim Shady please stand up?"""
 
-        person = self._get_person_by_username(irc, name)
-
-        if not person:
-            return
-
-        irc.reply(f"{person['username']} 'Slim Shady' <{person['emails'][0]}>")
+        for person in self._get_people(irc, names, from_cache=True):
+            irc.reply(f"{person['username']} 'Slim Shady' <{person['emails'][0]}>")
 
-    himynameis = wrap(himynameis, ["text"])
+    himynameis = wrap(himynameis, [many("somethingWithoutSpaces")])
 
     def dctime(self, irc, msg, args, dcname):
         """<dcname>
@@ -705,15 +1242,18 @@ class Fedora(callbacks.Plugin):
 
     localtime = wrap(localtime, ["text"])
 
-    def fasinfo(self, irc, msg, args, name):
-        """<username>
+    def fasinfo(self, irc, msg, args, names):
+        """<username> [<username> ...]
 
-        Return information on a Fedora Account System username."""
+        Return information on Fedora Account System usernames."""
 
-        person = self._get_person_by_username(irc, name)
-        if not person:
-            return
+        for person in self._get_people(irc, names):
+            self._fasinfo(irc, person)
 
+    fasinfo = wrap(fasinfo, [many("somethingWithoutSpaces")])
+
+    def _fasinfo(self, irc, person):
+        name = person["username"]
         if self.registryValue("use_fasjson"):
             nicks = get_ircnicks(person)
             irc.reply(
@@ -741,7 +1281,7 @@ class Fedora(callbacks.Plugin):
                 ", Locale: %(locale)s"
                 ", GPG key ID: %(gpg_keyid)s, Status: %(status)s"
             ) % person
-            irc.reply(string.encode("utf-8"))
+            irc.reply(string)
 
             # List of unapproved groups is easy
             unapproved = ""
@@ -775,8 +1315,6 @@ class Fedora(callbacks.Plugin):
 
             irc.reply("Approved Groups: %s" % approved)
 
-    fasinfo = wrap(fasinfo, ["text"])
-
     def group(self, irc, msg, args, name):
         """<group short name>
 
@@ -784,15 +1322,22 @@ class Fedora(callbacks.Plugin):
 
         if self.registryValue("use_fasjson"):
             try:
-                group = self.fasjsonclient.get_group(groupname=name).result
+                group = self._cached(
+                    "group",
+                    ("get_group", name),
+                    functools.partial(
+                        self._fasjson_lookup,
+                        self.fasjsonclient.get_group,
+                        groupname=name,
+                    ),
+                )
             except fasjson_client.errors.APIError as e:
-                if e.code == 404:
-                    irc.reply(f"Sorry, but group '{name}' does not exist")
-                    return
-                else:
-                    irc.reply("Something blew up, please try again")
-                    self.log.error(e)
-                    return
+                irc.reply("Something blew up, please try again")
+                self.log.error(e)
+                return
+            if group is None:
+                irc.reply(f"Sorry, but group '{name}' does not exist")
+                return
 
             irc.reply(f"{group['groupname']}: {group['description']}")
         else:
@@ -830,15 +1375,22 @@ class Fedora(callbacks.Plugin):
 
         if self.registryValue("use_fasjson"):
             try:
-                sponsors = self.fasjsonclient.list_group_sponsors(groupname=name).result
+                sponsors = self._cached(
+                    "sponsors",
+                    ("list_group_sponsors", name),
+                    functools.partial(
+                        self._fasjson_lookup,
+                        self.fasjsonclient.list_group_sponsors,
+                        groupname=name,
+                    ),
+                )
             except fasjson_client.errors.APIError as e:
-                if e.code == 404:
-                    irc.reply(f"Sorry, but group '{name}' does not exist")
-                    return
-                else:
-                    irc.reply("Something blew up, please try again")
-                    self.log.error(e)
-                    return
+                irc.reply("Something blew up, please try again")
+                self.log.error(e)
+                return
+            if sponsors is None:
+                irc.reply(f"Sorry, but group '{name}' does not exist")
+                return
 
             irc.reply(
                 f"Sponsors for {name}: {', '.join(s['username'] for s in sponsors)}"
@@ -864,15 +1416,22 @@ class Fedora(callbacks.Plugin):
         Return a list of members of the specified group"""
         if self.registryValue("use_fasjson"):
             try:
-                members = self.fasjsonclient.list_group_members(groupname=name).result
+                members = self._cached(
+                    "members",
+                    ("list_group_members", name),
+                    functools.partial(
+                        self._fasjson_lookup,
+                        self.fasjsonclient.list_group_members,
+                        groupname=name,
+                    ),
+                )
             except fasjson_client.errors.APIError as e:
-                if e.code == 404:
-                    irc.reply(f"Sorry, but group '{name}' does not exist")
-                    return
-                else:
-                    irc.reply("Something blew up, please try again")
-                    self.log.error(e)
-                    return
+                irc.reply("Something blew up, please try again")
+                self.log.error(e)
+                return
+            if members is None:
+                irc.reply(f"Sorry, but group '{name}' does not exist")
+                return
 
             irc.reply(f"Members of {name}: {', '.join(m['username'] for m in members)}")
         else:
@@ -982,12 +1541,15 @@ class Fedora(callbacks.Plugin):
                 irc.reply(admonition)
 
     def get_current_release(self):
+        return self.release_cache.get()
+
+    def _fetch_current_release(self):
         url = (
             "https://pdc.fedoraproject.org/rest_api/v1/releases/"
             "?active=true&name=Fedora&release_type=ga&fields=version"
             "&ordering=version"
         )
-        response = requests.get(url)
+        response = self.http.get("pdc", url)
         data = response.json()
         return "f" + str(
             max(
@@ -999,46 +1561,48 @@ class Fedora(callbacks.Plugin):
             )
         )
 
-    def open_karma_db(self):
-        data = shelve.open(self.karma_db_path)
-        if "backwards" in data:
-            # This is the old style data.  convert it to the new form.
-            release = self.get_current_release()
-            data["forwards-" + release] = copy.copy(data["forwards"])
-            data["backwards-" + release] = copy.copy(data["backwards"])
-            del data["forwards"]
-            del data["backwards"]
-            data.sync()
-        return data
+    @property
+    def karma_store(self):
+        """The karma storage engine, (re)opened as the config requires."""
+        backend = self.registryValue("karma.backend")
+        if backend == "sqlite":
+            path = self.registryValue("karma.sqlite_path") or (
+                self.karma_db_path + ".sqlite"
+            )
+        else:
+            path = self.karma_db_path
+
+        with self._karma_store_lock:
+            store = self._karma_store
+            if store is not None and store.path == path:
+                return store
+            if store is not None:
+                store.close()
+            if backend == "sqlite":
+                store = SQLiteKarmaStore(path)
+                imported = store.import_shelve(
+                    self.karma_db_path, self.get_current_release
+                )
+                if imported is not None:
+                    self.log.info(
+                        "Imported %i karma votes from %s"
+                        % (imported, self.karma_db_path)
+                    )
+            else:
+                store = ShelveKarmaStore(path, self.get_current_release)
+            self._karma_store = store
+            return store
 
     def karma(self, irc, msg, args, name):
         """<username>
 
         Return the total karma for a FAS user."""
-        data = None
-        try:
-            data = self.open_karma_db()
-            if name in self.nickmap:
-                name = self.nickmap[name]
-            current_release = self.get_current_release()
-            votes = data["backwards-" + current_release].get(name, {})
-            alltime = []
-            for key in data:
-                if "backwards-" not in key:
-                    continue
-                alltime.append(data[key].get(name, {}))
-        finally:
-            if data:
-                data.close()
-
-        inc = len([v for v in votes.values() if v == 1])
-        dec = len([v for v in votes.values() if v == -1])
+        name = self.accounts.resolve(name) or name
+        current_release = self.get_current_release()
+        inc, dec = self.karma_store.release_totals(current_release, name)
         total = inc - dec
 
-        alltime_inc = alltime_dec = 0
-        for release in alltime:
-            alltime_inc += len([v for v in release.values() if v == 1])
-            alltime_dec += len([v for v in release.values() if v == -1])
+        alltime_inc, alltime_dec = self.karma_store.alltime_totals(name)
         alltime_total = alltime_inc - alltime_dec
 
         irc.reply(
@@ -1050,6 +1614,19 @@ class Fedora(callbacks.Plugin):
 
     karma = wrap(karma, ["text"])
 
+    def karmaverify(self, irc, msg, args):
+        """takes no arguments
+
+        Recompute the karma totals from the recorded votes, and report how
+        many of them had drifted."""
+        if not self.karma_store.maintains_totals:
+            irc.reply("The karma storage backend does not maintain totals.")
+            return
+        drift = self.karma_store.rebuild_totals()
+        irc.reply("Karma totals rebuilt, %i of them had drifted." % drift)
+
+    karmaverify = wrap(karmaverify, ["admin"])
+
     def _do_karma(self, irc, channel, agent, recip, line, explicit=False):
         recip, direction = recip[:-2], recip[-2:]
         if not recip:
@@ -1064,25 +1641,24 @@ class Fedora(callbacks.Plugin):
 
         increment = direction == "++"  # If not, then it must be decrement
 
-        # Check that these are FAS users
-        if agent not in self.nickmap and agent not in self.users:
+        # Check that these are FAS users, and transform irc nicks into fas
+        # usernames.
+        accounts = self.accounts
+        agent_name = accounts.resolve(agent)
+        if agent_name is None:
             self.log.info("Saw %s from %s, but %s not in FAS" % (recip, agent, agent))
             if explicit:
                 irc.reply("Couldn't find %s in FAS" % agent)
             return
 
-        if recip not in self.nickmap and recip not in self.users:
+        recip_name = accounts.resolve(recip)
+        if recip_name is None:
             self.log.info("Saw %s from %s, but %s not in FAS" % (recip, agent, recip))
             if explicit:
                 irc.reply("Couldn't find %s in FAS" % recip)
             return
 
-        # Transform irc nicks into fas usernames if possible.
-        if agent in self.nickmap:
-            agent = self.nickmap[agent]
-
-        if recip in self.nickmap:
-            recip = self.nickmap[recip]
+        agent, recip = agent_name, recip_name
 
         if agent == recip:
             irc.reply("You may not modify your own karma.")
@@ -1091,55 +1667,17 @@ class Fedora(callbacks.Plugin):
         release = self.get_current_release()
 
         # Check our karma db to make sure this hasn't already been done.
-        data = None
-        try:
-            data = shelve.open(self.karma_db_path)
-            fkey = "forwards-" + release
-            bkey = "backwards-" + release
-            if fkey not in data:
-                data[fkey] = {}
-
-            if bkey not in data:
-                data[bkey] = {}
-
-            if agent not in data[fkey]:
-                forwards = data[fkey]
-                forwards[agent] = {}
-                data[fkey] = forwards
-
-            if recip not in data[bkey]:
-                backwards = data[bkey]
-                backwards[recip] = {}
-                data[bkey] = backwards
-
-            vote = 1 if increment else -1
-
-            if data[fkey][agent].get(recip) == vote:
-                # People found this response annoying.
-                # https://github.com/fedora-infra/supybot-fedora/issues/25
-                # irc.reply(
-                #    "You have already given %i karma to %s" % (vote, recip))
-                return
-
-            forwards = data[fkey]
-            forwards[agent][recip] = vote
-            data[fkey] = forwards
-
-            backwards = data[bkey]
-            backwards[recip][agent] = vote
-            data[bkey] = backwards
-
-            # Count the number of karmas for old so-and-so.
-            total_this_release = sum(data[bkey][recip].values())
+        vote = 1 if increment else -1
+        if not self.karma_store.vote(release, agent, recip, vote):
+            # People found this response annoying.
+            # https://github.com/fedora-infra/supybot-fedora/issues/25
+            # irc.reply(
+            #    "You have already given %i karma to %s" % (vote, recip))
+            return
 
-            total_all_time = 0
-            for key in data:
-                if "backwards-" not in key:
-                    continue
-                total_all_time += sum(data[key].get(recip, {}).values())
-        finally:
-            if data:
-                data.close()
+        # Count the number of karmas for old so-and-so.
+        inc, dec = self.karma_store.release_totals(release, recip)
+        total_this_release = inc - dec
 
         # fedmsg.publish(
         #    name="supybot.%s" % socket.gethostname(),
@@ -1163,36 +1701,38 @@ class Fedora(callbacks.Plugin):
             % (recip, total_this_release, release, url)
         )
 
-    def wikilink(self, irc, msg, args, name):
-        """<username>
-
-        Return MediaWiki link syntax for a FAS user's page on the wiki."""
+    def wikilink(self, irc, msg, args, names):
+        """<username> [<username> ...]
 
-        person = self._get_person_by_username(irc, name)
-        if not person:
-            return
+        Return MediaWiki link syntax for FAS users' pages on the wiki."""
 
-        string = "[[User:%s|%s]]" % (person["username"], person["human_name"] or "")
-        irc.reply(string.encode("utf-8"))
+        for person in self._get_people(irc, names, from_cache=True):
+            string = "[[User:%s|%s]]" % (person["username"], person["human_name"] or "")
+            irc.reply(string)
 
-    wikilink = wrap(wikilink, ["text"])
+    wikilink = wrap(wikilink, [many("somethingWithoutSpaces")])
 
     def mirroradmins(self, irc, msg, args, hostname):
         """<hostname>
 
         Return MirrorManager list of FAS usernames which administer <hostname>.
         <hostname> must be the FQDN of the host."""
+        hostname = hostname.lower()
         url = (
             "https://admin.fedoraproject.org/mirrormanager/api/"
             "mirroradmins?name=" + hostname
         )
-        result = self._load_json(url)
+        result = self._cached(
+            "mirroradmins",
+            ("mirrormanager", hostname),
+            functools.partial(self._load_json, "mirrormanager", url),
+        )
         if "admins" not in result:
             irc.reply(result.get("message", "Something went wrong"))
             return
         string = "Mirror Admins of %s: " % hostname
         string += " ".join(result["admins"])
-        irc.reply(string.encode("utf-8"))
+        irc.reply(string)
 
     mirroradmins = wrap(mirroradmins, ["text"])
 
@@ -1212,13 +1752,13 @@ class Fedora(callbacks.Plugin):
 
         if not persons:
             response = "Nobody is listed as being on push duty right now..."
-            irc.reply(response.encode("utf-8"))
-            irc.reply("- " + url.encode("utf-8"))
+            irc.reply(response)
+            irc.reply("- " + url)
             return
 
         persons = ", ".join(persons)
         response = "The following people are on push duty: %s" % persons
-        irc.reply(response.encode("utf-8"))
+        irc.reply(response)
         irc.reply(f"- {url}")
 
     pushduty = wrap(pushduty)
@@ -1238,14 +1778,14 @@ class Fedora(callbacks.Plugin):
 
         if not persons:
             response = "Nobody is listed as being on vacation right now..."
-            irc.reply(response.encode("utf-8"))
+            irc.reply(response)
             url = f"{self.fedocal_url}vacation/"
             irc.reply(f"- {url}")
             return
 
         persons = ", ".join(persons)
         response = "The following people are on vacation: %s" % persons
-        irc.reply(response.encode("utf-8"))
+        irc.reply(response)
         url = f"{self.fedocal_url}vacation/"
         irc.reply(f"- {url}")
 
@@ -1256,35 +1796,68 @@ class Fedora(callbacks.Plugin):
         Return the next meetings scheduled for any channel(s).
         """
         irc.reply("One moment, please...  Looking up the channel list.")
-        url = f"{self.fedocal_url}api/locations/"
-        locations = requests.get(url).json()["locations"]
-        self.log.error(f"{locations}")
-        meetings = sorted(
-            chain(
-                *[
-                    self._future_meetings(location)
-                    for location in locations
-                    if "irc.libera.chat" in location
-                ]
-            ),
-            key=itemgetter(0),
+        deadline = Deadline(self.registryValue("http.command_deadline"))
+        locations = self._cached(
+            "meetings",
+            ("fedocal", "locations"),
+            functools.partial(self._fetch_locations, deadline),
         )
+        locations = [
+            location for location in locations if "irc.libera.chat" in location
+        ]
+        meetings, complete = self._next_meetings(locations, 5, deadline)
 
-        if not meetings:
+        if not meetings and complete:
             response = "There are no meetings scheduled at all."
-            irc.reply(response.encode("utf-8"))
+            irc.reply(response)
             return
 
-        for date, meeting in meetings[:5]:
+        for date, meeting in meetings:
             response = "In #%s is %s (starting %s)" % (
                 meeting["meeting_location"].split("@")[0].strip(),
                 meeting["meeting_name"],
                 arrow.get(date).humanize(),
             )
-            irc.reply(response.encode("utf-8"))
+            irc.reply(response)
+
+        if not complete:
+            irc.reply(
+                "Some channels took too long to answer, the list may be incomplete."
+            )
 
     nextmeetings = wrap(nextmeetings, [])
 
+    def _next_meetings(self, locations, n, deadline):
+        """Return the next n meetings in any of some locations.
+
+        The schedules of every location are fetched at the same time in the
+        worker pool, then their meetings lazily merged by date until the first
+        n are found.
+        If some locations could not be fetched by the deadline, the meetings
+        in the others are returned.
+
+        Return a list of (date, meeting) tuples, and whether all locations
+        were fetched.
+        """
+        futures = {
+            self.workers.submit(self._future_meetings, location, deadline): location
+            for location in locations
+        }
+        done, not_done = wait(futures, timeout=max(deadline.remaining(), 0))
+        for future in not_done:
+            future.cancel()
+        schedules = []
+        for future in done:
+            try:
+                schedules.append(future.result())
+            except (IOError, ValueError) as e:
+                self.log.warning(
+                    "Could not get the meetings in %s: %s", futures[future], e
+                )
+                not_done.add(future)
+        merged = heapq.merge(*schedules, key=itemgetter(0))
+        return list(itertools.islice(merged, n)), not not_done
+
     def nextmeeting(self, irc, msg, args, channel):
         """<channel>
 
@@ -1292,58 +1865,60 @@ class Fedora(callbacks.Plugin):
         """
 
         channel = channel.strip("#").split("@")[0]
-        meetings = sorted(self._future_meetings(channel), key=itemgetter(0))
+        meetings = list(itertools.islice(self._future_meetings(channel), 3))
 
         if not meetings:
             response = "There are no meetings scheduled for #%s." % channel
-            irc.reply(response.encode("utf-8"))
+            irc.reply(response)
             return
 
-        for date, meeting in meetings[:3]:
+        for date, meeting in meetings:
             response = "In #%s is %s (starting %s)" % (
                 channel,
                 meeting["meeting_name"],
                 arrow.get(date).humanize(),
             )
-            irc.reply(response.encode("utf-8"))
+            irc.reply(response)
         base = f"{self.fedocal_url}location/"
         url = base + urllib.parse.quote("%s@irc.libera.chat/" % channel)
-        irc.reply("- " + url.encode("utf-8"))
+        irc.reply("- " + url)
 
     nextmeeting = wrap(nextmeeting, ["text"])
 
-    def _future_meetings(self, location):
+    def _future_meetings(self, location, deadline=None):
+        """Return an iterator of the next (date, meeting) in a location."""
         if not location.endswith("@irc.libera.chat"):
             location = "%s@irc.libera.chat" % location
-        meetings = self._query_fedocal(location=location)
-        now = datetime.datetime.utcnow()
+        schedule = self._schedule("location", location, deadline)
+        return schedule.upcoming(datetime.datetime.utcnow())
 
-        for meeting in meetings:
-            string = "%s %s" % (meeting["meeting_date"], meeting["meeting_time_start"])
-            dt = datetime.datetime.strptime(string, "%Y-%m-%d %H:%M:%S")
+    def _meetings_for(self, calendar):
+        schedule = self._schedule("calendar", calendar)
+        return schedule.ongoing(datetime.datetime.utcnow())
 
-            if now < dt:
-                yield dt, meeting
+    def _schedule(self, kind, name, deadline=None):
+        """Return the Schedule of a fedocal location or calendar.
 
-    def _meetings_for(self, calendar):
-        meetings = self._query_fedocal(calendar=calendar)
-        now = datetime.datetime.utcnow()
-
-        for meeting in meetings:
-            string = "%s %s" % (meeting["meeting_date"], meeting["meeting_time_start"])
-            start = datetime.datetime.strptime(string, "%Y-%m-%d %H:%M:%S")
-            string = "%s %s" % (
-                meeting["meeting_date_end"],
-                meeting["meeting_time_stop"],
-            )
-            end = datetime.datetime.strptime(string, "%Y-%m-%d %H:%M:%S")
+        Schedules are kept in the response cache, so that all the commands
+        looking up meetings share them.
+        """
+        return self._cached(
+            "meetings",
+            ("fedocal", kind, name),
+            functools.partial(self._fetch_schedule, kind, name, deadline),
+        )
 
-            if now >= start and now <= end:
-                yield meeting
+    def _fetch_schedule(self, kind, name, deadline=None):
+        return Schedule(self._query_fedocal(deadline, **{kind: name}))
+
+    def _fetch_locations(self, deadline=None):
+        url = f"{self.fedocal_url}api/locations/"
+        return self.http.get("fedocal", url, deadline=deadline).json()["locations"]
 
-    def _query_fedocal(self, **kwargs):
+    def _query_fedocal(self, deadline=None, **kwargs):
         url = f"{self.fedocal_url}api/meetings"
-        return requests.get(url, params=kwargs).json()["meetings"]
+        response = self.http.get("fedocal", url, deadline=deadline, params=kwargs)
+        return response.json()["meetings"]
 
     def badges(self, irc, msg, args, name):
         """<username>
@@ -1351,19 +1926,27 @@ class Fedora(callbacks.Plugin):
         Return badges statistics about a user.
         """
         url = "https://badges.fedoraproject.org/user/" + name
-        d = requests.get(url + "/json").json()
+        d = self._cached(
+            "badges", ("badges", name), functools.partial(self._fetch_badges, url)
+        )
 
-        if "error" in d:
-            response = d["error"]
+        if d is None:
+            response = "No such user exists."
         else:
             template = "{name} has unlocked {n} Fedora Badges:  {url}"
             n = len(d["assertions"])
             response = template.format(name=name, url=url, n=n)
 
-        irc.reply(response.encode("utf-8"))
+        irc.reply(response)
 
     badges = wrap(badges, ["text"])
 
+    def _fetch_badges(self, url):
+        data = self.http.get("badges", url + "/json").json()
+        if "error" in data:
+            return None
+        return data
+
     def quote(self, irc, msg, args, arguments):
         """<SYMBOL> [daily, weekly, monthly, quarterly]
 
@@ -1386,20 +1969,14 @@ class Fedora(callbacks.Plugin):
         # then override those that don't make sense manually here.  For
         # instance "fedoratagger" by default would be "FED", but that's no
         # good.  We want "TAG".
-        # Why all this trouble?  Well, as new things get added to the fedmsg
-        # bus, we don't want to have keep coming back here and modifying this
-        # code.  Hopefully this dance will at least partially future-proof us.
-        symbols = dict(
-            [
-                (processor.__name__.lower(), processor.__name__[:3].upper())
-                for processor in fedmsg.meta.processors  # noqa: F821
-            ]
-        )
+        symbols = dict([(name, name[:3].upper()) for name in QUOTE_CATEGORIES])
         symbols.update(
             {
                 "fedoratagger": "TAG",
                 "fedbadges": "BDG",
+                "fedimg": "IMG",
                 "buildsys": "KOJ",
+                "git": "SCM",
                 "pkgdb": "PKG",
                 "meetbot": "MTB",
                 "planet": "PLN",
@@ -1409,19 +1986,13 @@ class Fedora(callbacks.Plugin):
         )
 
         # Now invert the dict so we can lookup the argued symbol.
-        # Yes, this is vulnerable to collisions.
         symbols = dict([(sym, name) for name, sym in symbols.items()])
 
-        # These aren't user-facing topics, so drop 'em.
-        del symbols["LOG"]
-        del symbols["UNH"]
-        del symbols["ANN"]  # And this one is unused...
-
         key_fmt = lambda d: ", ".join(sorted(d.keys()))  # noqa: E731
 
         if symbol not in symbols:
             response = "No such symbol %r.  Try one of %s"
-            irc.reply((response % (symbol, key_fmt(symbols))).encode("utf-8"))
+            irc.reply(response % (symbol, key_fmt(symbols)))
             return
 
         # Now, build another lookup of our various timeframes.
@@ -1434,35 +2005,32 @@ class Fedora(callbacks.Plugin):
 
         if frame not in frames:
             response = "No such timeframe %r.  Try one of %s"
-            irc.reply((response % (frame, key_fmt(frames))).encode("utf-8"))
+            irc.reply(response % (frame, key_fmt(frames)))
             return
 
         category = [symbols[symbol]]
 
-        t2 = datetime.datetime.utcnow()
-        t1 = t2 - frames[frame]
-        t0 = t1 - frames[frame]
-
-        # Count the number of messages between t0 and t1, and between t1 and t2
+        # The sparkline starts at the beginning of its first point, a bit
+        # less than a frame ago.  The period it is compared to lasts just as
+        # long, so that the percentage is not biased by the missing bit.
+        span = frames[frame].total_seconds()
+        t2 = time.time()
+        t1 = self._sparkline_start(span, t2)
+        t0 = t1 - (t2 - t1)
+
+        # Count the number of messages between t0 and t1, while getting those
+        # between t1 and t2 for the sparkline.
+        deadline = Deadline(self.registryValue("http.command_deadline"))
         query1 = dict(start=t0, end=t1, category=category)
-        query2 = dict(start=t1, end=t2, category=category)
-
-        # Do this async for superfast datagrepper queries.
-        tpool = ThreadPool()
-        batched_values = tpool.map(
-            datagrepper_query,
-            [
-                dict(start=x, end=y, category=category)
-                for x, y in Utils.daterange(t1, t2, SPARKLINE_RESOLUTION)
-            ]
-            + [query1, query2],
-        )
-
-        count2 = batched_values.pop()
-        count1 = batched_values.pop()
-
-        # Just rename the results.  We'll use the rest for the sparkline.
-        sparkline_values = batched_values
+        previous = self.workers.submit(datagrepper_query, self.http, query1)
+        try:
+            sparkline_values = self._sparkline_counts(category, span, t2, deadline)
+            count1 = previous.result(max(deadline.remaining(), 0))
+        except TimeoutError:
+            previous.cancel()
+            irc.reply("Sorry, datagrepper took too long to answer.")
+            return
+        count2 = sum(sparkline_values)
 
         yester_phrases = dict(
             daily="yesterday",
@@ -1502,7 +2070,7 @@ class Fedora(callbacks.Plugin):
             percent=abs(percent),
             phrase=yester_phrases[frame],
         )
-        irc.reply(response.encode("utf-8"))
+        irc.reply(response)
 
         # Now, make a graph out of it.
         sparkline = Utils.sparkline(sparkline_values)
@@ -1511,19 +2079,83 @@ class Fedora(callbacks.Plugin):
         response = template.format(
             sym=symbol, sparkline=sparkline, phrase=phrases[frame]
         )
-        irc.reply(response.encode("utf-8"))
+        irc.reply(response)
 
-        to_utc = lambda t: time.gmtime(time.mktime(t.timetuple()))  # noqa: E731
         # And a final line for "x-axis tics"
-        t1_fmt = time.strftime("%H:%M UTC %m/%d", to_utc(t1))
-        t2_fmt = time.strftime("%H:%M UTC %m/%d", to_utc(t2))
+        t1_fmt = time.strftime("%H:%M UTC %m/%d", time.gmtime(t1))
+        t2_fmt = time.strftime("%H:%M UTC %m/%d", time.gmtime(t2))
         padding = " " * (SPARKLINE_RESOLUTION - len(t1_fmt) - 3)
         template = "     ↑ {t1}{padding}↑ {t2}"
         response = template.format(t1=t1_fmt, t2=t2_fmt, padding=padding)
-        irc.reply(response.encode("utf-8"))
+        irc.reply(response)
 
     quote = wrap(quote, ["text"])
 
+    @staticmethod
+    def _sparkline_start(span, now):
+        """Return when the first point of a sparkline of span seconds starts.
+
+        The points of sparklines are aligned on multiples of their width, so
+        that all but the last one stay the same from one quote to the next.
+        """
+        width = span / SPARKLINE_RESOLUTION
+        return (now // width - SPARKLINE_RESOLUTION + 1) * width
+
+    def _sparkline_counts(self, category, span, now, deadline):
+        """Count the msgs of a category in each point of a sparkline.
+
+        The counts of the points which ended long enough ago are cached, so
+        only the last one or two points are usually left to count.  Their
+        msgs are fetched, in as few pages as datagrepper allows, and counted
+        here.  If there are more than quote.max_pages pages of them,
+        datagrepper is rather asked to count each point.
+        """
+        width = span / SPARKLINE_RESOLUTION
+        key = (tuple(category), width)
+        last = int(now // width)
+        points = range(last - SPARKLINE_RESOLUTION + 1, last + 1)
+        settled = int((now - DATAGREPPER_SETTLE_TIME) // width)
+        counts = self.sparkline_buckets.get(key, [n for n in points if n < settled])
+        first = min(n for n in points if n not in counts)
+
+        params = dict(start=first * width, end=now, category=category)
+        first_page = datagrepper_page(self.http, params, 1)
+        pages = int(first_page.get("pages", 1))
+        if pages > self.registryValue("quote.max_pages"):
+            counted = self.workers.map(
+                functools.partial(datagrepper_query, self.http),
+                [
+                    dict(
+                        start=n * width,
+                        end=min((n + 1) * width, now),
+                        category=category,
+                    )
+                    for n in range(first, last + 1)
+                ],
+                timeout=max(deadline.remaining(), 0),
+            )
+        else:
+            rest = self.workers.map(
+                functools.partial(datagrepper_page, self.http, params),
+                range(2, pages + 1),
+                timeout=max(deadline.remaining(), 0),
+            )
+            timestamps = [
+                message_timestamp(message)
+                for page in [first_page] + rest
+                for message in page["raw_messages"]
+            ]
+            counted = histogram(
+                timestamps, first * width, (last + 1) * width, last + 1 - first
+            )
+
+        fetched = dict(zip(range(first, last + 1), counted))
+        self.sparkline_buckets.store(
+            key, width, {n: c for n, c in fetched.items() if n < settled}
+        )
+        counts.update(fetched)
+        return [counts[n] for n in points]
+
 
 class Utils(object):
     """Some handy utils for datagrepper visualization."""
@@ -1544,15 +2176,6 @@ class Utils(object):
         unicode_sparkline = "".join([bar[i] for i in indices])
         return unicode_sparkline
 
-    @classmethod
-    def daterange(cls, start, stop, steps):
-        """A generator for stepping through time."""
-        delta = (stop - start) / steps
-        current = start
-        while current + delta <= stop:
-            yield current, current + delta
-            current += delta
-
 
 Class = Fedora
 
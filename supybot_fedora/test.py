@@ -27,18 +27,49 @@
 # POSSIBILITY OF SUCH DAMAGE.
 ###
 
+import json
 import os
+import shelve
+import sqlite3
+import threading
+import time
+from concurrent.futures import TimeoutError
 from unittest import mock
 from tempfile import TemporaryDirectory
 
+import arrow
+import requests
 from supybot import test, world, conf
 
+from supybot_fedora.accounts import AccountCache
+from supybot_fedora.karmadb import ShelveKarmaStore
+from supybot_fedora.meetings import Schedule
+from supybot_fedora.webclient import Deadline, HTTPClient
+
 world.myVerbose = test.verbosity.MESSAGES
 
 
 class FASJSONResult:
-    def __init__(self, result):
+    def __init__(self, result, page=None):
         self.result = result
+        self.page = page
+
+
+def wait_for(condition, timeout=5):
+    """Poll a condition until it holds, failing after timeout seconds."""
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError("timed out waiting for %r" % condition)
+        time.sleep(0.01)
+
+
+def make_accounts(usernames, nickmap):
+    accounts = AccountCache()
+    for username in usernames:
+        nicks = [nick for nick, user in nickmap.items() if user == username]
+        accounts.add(username, None, None, nicks)
+    return accounts
 
 
 class FedoraTestCase(test.ChannelPluginTestCase):
@@ -57,6 +88,9 @@ class FedoraTestCase(test.ChannelPluginTestCase):
         conf.supybot.plugins.Fedora.karma.db_path.setValue(
             os.path.join(self.tmpdir.name, "karma.db")
         )
+        conf.supybot.plugins.Fedora.fasjson.snapshot_path.setValue(
+            os.path.join(self.tmpdir.name, "users.snapshot")
+        )
 
     def tearDown(self):
         self.tmpdir.cleanup()
@@ -67,24 +101,107 @@ class FedoraTestCase(test.ChannelPluginTestCase):
 
     @mock.patch("supybot_fedora.plugin.Fedora.get_current_release", return_value="f38")
     def testKarma(self, mock_get_current_release):
-        self.instance.users = ["dummy", "test"]
-        self.instance.nickmap = {"dummy": "dummy"}
+        self.instance.accounts = make_accounts(["dummy", "test"], {"dummy": "dummy"})
         expected = (
             "Karma for dummy changed to 1 (for the release cycle f38):  "
             "https://badges.fedoraproject.org/badge/macaron-cookie-i"
         )
         self.assertResponse("dummy++", expected)
 
+    @mock.patch("supybot_fedora.plugin.Fedora.get_current_release", return_value="f38")
+    def testKarmaImportsShelve(self, mock_get_current_release):
+        data = shelve.open(self.instance.karma_db_path)
+        data["forwards-f37"] = {"test": {"dummy": 1}, "other": {"dummy": -1}}
+        data["backwards-f37"] = {"dummy": {"test": 1, "other": -1}}
+        data["forwards-f38"] = {"other": {"dummy": 1}}
+        data["backwards-f38"] = {"dummy": {"other": 1}}
+        data.close()
+        self.instance.accounts = make_accounts(["dummy", "test"], {})
+        self.assertResponse(
+            "karma dummy",
+            "Karma for dummy has been increased 1 times and decreased 0 times "
+            "for release cycle f38 for a total of 1 (1 all time)",
+        )
+        self.assertRegexp("dummy++", "Karma for dummy changed to 2 ")
+        self.assertRegexp("karma dummy", "total of 2 \\(2 all time\\)")
+
+    @mock.patch("supybot_fedora.plugin.Fedora.get_current_release", return_value="f38")
+    def testKarmaTotalsFollowFlippedVotes(self, mock_get_current_release):
+        store = self.instance.karma_store
+        store.vote("f37", "test", "dummy", 1)
+        store.vote("f38", "test", "dummy", 1)
+        store.vote("f38", "other", "dummy", 1)
+        store.vote("f38", "test", "dummy", -1)
+        self.assertEqual(store.release_totals("f38", "dummy"), (1, 1))
+        self.assertEqual(store.alltime_totals("dummy"), (2, 1))
+        self.assertEqual(store.rebuild_totals(), 0)
+        with store.conn:
+            store.conn.execute("UPDATE alltime_totals SET inc = 5")
+        self.assertEqual(store.rebuild_totals(), 1)
+        self.assertEqual(store.alltime_totals("dummy"), (2, 1))
+
+    def testShelveKarmaStoreHasNoTotals(self):
+        store = ShelveKarmaStore(self.instance.karma_db_path, lambda: "f38")
+        store.vote("f38", "test", "dummy", 1)
+        self.assertFalse(store.maintains_totals)
+        self.assertEqual(store.rebuild_totals(), 0)
+        self.assertEqual(store.release_totals("f38", "dummy"), (1, 0))
+
     def testKarmaActorNotInFAS(self):
-        self.instance.users = ["dummy"]
-        self.instance.nickmap = {"dummy": "dummy"}
+        self.instance.accounts = make_accounts(["dummy"], {"dummy": "dummy"})
         self.assertResponse("dummy++", "Couldn't find test in FAS")
 
     def testKarmaTargetNotInFAS(self):
-        self.instance.users = ["test"]
-        self.instance.nickmap = {}
+        self.instance.accounts = make_accounts(["test"], {})
         self.assertResponse("dummy++", "Couldn't find dummy in FAS")
 
+    def testFasSearch(self):
+        accounts = self.instance.accounts = AccountCache()
+        accounts.add("dummy", "Dummy User", "dummy@example.com", [])
+        accounts.add("dumdum", None, "dd@example.com", ["dummy"])
+        accounts.add("test", "Test User", "test@example.com", [])
+        self.assertResponse(
+            "fas dummy",
+            "dummy 'Dummy User' <dummy@example.com> - dumdum '' <dd@example.com>",
+        )
+        self.assertResponse("fas nobody", "'nobody' Not Found!")
+        # Short queries only match whole usernames and nicks
+        self.assertResponse("fas du", "'du' Not Found!")
+
+    def testFasSearchLimit(self):
+        accounts = self.instance.accounts = AccountCache()
+        for i in range(20):
+            accounts.add(f"user{i:02}", None, "u@example.com", [])
+        with conf.supybot.plugins.Fedora.fas.search_limit.context(2):
+            self.assertResponse(
+                "fas user",
+                "user00 '' <u@example.com> - user01 '' <u@example.com> - "
+                "... and 18 more.",
+            )
+            with mock.patch("supybot_fedora.accounts.COUNT_LIMIT", 10):
+                self.assertResponse(
+                    "fas user",
+                    "user00 '' <u@example.com> - user01 '' <u@example.com> - "
+                    "... and about 18 more.",
+                )
+
+    def testCurrentReleaseCached(self):
+        fetch = self.instance.release_cache.fetch = mock.Mock(return_value="f38")
+        self.assertEqual(self.instance.get_current_release(), "f38")
+        self.assertEqual(self.instance.get_current_release(), "f38")
+        self.assertEqual(fetch.call_count, 1)
+        # Serve the stale release when PDC is unavailable, while trying again
+        # in the background
+        self.instance.release_cache.fetched_at -= 86400
+        fetch.side_effect = IOError("PDC is down")
+        self.assertEqual(self.instance.get_current_release(), "f38")
+        wait_for(lambda: not self.instance.release_cache._refreshing)
+        self.assertEqual(fetch.call_count, 2)
+        # and do not try again right after the failure
+        self.assertEqual(self.instance.get_current_release(), "f38")
+        self.assertEqual(fetch.call_count, 2)
+        self.assertRegexp("cachestats", "1 hits, 3 misses, 1 errors")
+
     def testRefreshIRCNickFormat(self):
         nickformats = ["irc:/dummy", "irc://irc.libera.chat/dummy"]
         for nick in nickformats:
@@ -100,8 +217,591 @@ class FedoraTestCase(test.ChannelPluginTestCase):
             )
             self.instance.fasjsonclient.list_users.return_value = result
             self.instance._refresh()
-            self.assertEqual(self.instance.users, ["dummy"])
-            self.assertEqual(self.instance.nickmap, {"dummy": "dummy"})
+            accounts = self.instance.accounts
+            self.assertEqual(set(accounts.uids), {"dummy"})
+            self.assertEqual(accounts.nickmap, {"dummy": "dummy"})
+
+    @mock.patch("supybot_fedora.plugin.Fedora.get_current_release", return_value="f38")
+    def testKarmaNickCaseInsensitive(self, mock_get_current_release):
+        self.instance.accounts = make_accounts(["dummy", "test"], {"Dummy_": "dummy"})
+        expected = (
+            "Karma for dummy changed to 1 (for the release cycle f38):  "
+            "https://badges.fedoraproject.org/badge/macaron-cookie-i"
+        )
+        self.assertResponse("dummy_++", expected)
+
+    def testUserCacheSnapshot(self):
+        result = FASJSONResult(
+            [
+                {
+                    "username": "dummy",
+                    "emails": ["dummy@example.com"],
+                    "ircnicks": ["irc:/Dummy"],
+                    "human_name": "Dummy User",
+                }
+            ]
+        )
+        self.instance.fasjsonclient.list_users.return_value = result
+        self.instance._refresh()
+        self.instance.accounts = AccountCache()
+        self.assertTrue(self.instance._load_snapshot())
+        self.assertEqual(self.instance.accounts.resolve("dummy"), "dummy")
+        self.assertEqual(self.instance.accounts.resolve("DUMMY"), "dummy")
+        self.assertResponse("fas dumm", "dummy 'Dummy User' <dummy@example.com>")
+
+        with conf.supybot.plugins.Fedora.fasjson.snapshot_max_age.context(1):
+            with mock.patch("time.time", return_value=time.time() + 10):
+                self.assertFalse(self.instance._load_snapshot())
+
+    def testSnapshotPath(self):
+        with conf.supybot.plugins.Fedora.fasjson.snapshot_path.context("users.json"):
+            self.assertEqual(
+                self.instance._snapshot_path(),
+                os.path.join(conf.supybot.directories.data(), "users.json"),
+            )
+
+    def testIncrementalSync(self):
+        def user(username, human_name, nick):
+            return {
+                "username": username,
+                "emails": [f"{username}@example.com"],
+                "ircnicks": [f"irc:/{nick}"],
+                "human_name": human_name,
+            }
+
+        list_users = self.instance.fasjsonclient.list_users
+        list_users.return_value = FASJSONResult(
+            [user("dummy", "Dummy", "dummy"), user("test", "Test", "test")]
+        )
+        self.instance._refresh()
+        before = self.instance.accounts
+        list_users.side_effect = [
+            FASJSONResult([user("dummy", "Dummy User", "dumdum")], {"total_pages": 2}),
+            FASJSONResult([user("new", "New", "new")], {"total_pages": 2}),
+        ]
+        self.instance._refresh()
+        # The sync was applied to a copy of the cache
+        self.assertEqual(set(before.uids), {"dummy", "test"})
+        self.assertEqual(before.get("dummy").human_name, "Dummy")
+        self.assertEqual(list_users.call_args[1]["page_number"], 2)
+        self.assertEqual(
+            self.instance.sync_stats[:48],
+            "synced 2 pages: 1 added, 1 changed, 1 removed in",
+        )
+        accounts = self.instance.accounts
+        self.assertEqual(set(accounts.uids), {"dummy", "new"})
+        self.assertEqual(accounts.nickmap, {"dumdum": "dummy", "new": "new"})
+        self.assertResponse("fas dum", "dummy 'Dummy User' <dummy@example.com>")
+
+        # Lookups get the new version of an account before the old one goes
+        def delete(uid):
+            self.assertEqual(accounts.get("dummy").human_name, "Dummy")
+
+        with mock.patch.object(accounts, "_delete", side_effect=delete):
+            accounts.update("dummy", "Dummy", "dummy@example.com", ["dumdum"])
+
+    def testRefreshPaged(self):
+        self.instance.fasjsonclient.list_users.side_effect = [
+            FASJSONResult(
+                [
+                    {
+                        "username": f"user{page}",
+                        "emails": [f"user{page}@example.com"],
+                        "ircnicks": None,
+                        "human_name": None,
+                    }
+                ],
+                {"total_pages": 2},
+            )
+            for page in (1, 2)
+        ]
+        self.instance._refresh()
+        self.assertEqual(set(self.instance.accounts.uids), {"user1", "user2"})
+        self.assertRegexp("cachestats", "downloaded 2 users in .*peak RSS")
+
+    def testWhat(self):
+        response = mock.Mock(status_code=200, headers={})
+        response.json.return_value = {"summary": "A dummy package"}
+        with mock.patch.object(
+            self.instance.http.session, "get", return_value=response
+        ) as get:
+            self.assertResponse("what dummy", "dummy: A dummy package")
+        self.assertEqual(get.call_args[1]["timeout"], (5, 30))
+        self.assertRegexp("httpstats", "mdapi: 1 requests, 0 errors")
+
+    def testPackageIndex(self):
+        primary_db = os.path.join(self.tmpdir.name, "primary.sqlite")
+        with sqlite3.connect(primary_db) as db:
+            db.execute("CREATE TABLE packages (name, summary, rpm_sourcerpm)")
+            db.executemany(
+                "INSERT INTO packages VALUES (?, ?, ?)",
+                [
+                    (
+                        "python-dummy",
+                        "A dummy library",
+                        "python-dummy-1.0-1.fc34.src.rpm",
+                    ),
+                    (
+                        "python3-dummy",
+                        "Dummy for Python 3",
+                        "python-dummy-1.0-1.fc34.src.rpm",
+                    ),
+                    ("dummy-tools", "Dummy tools", "dummy-tools-2-1.fc34.src.rpm"),
+                ],
+            )
+        db.close()
+        acl_dump = os.path.join(self.tmpdir.name, "acls.json")
+        with open(acl_dump, "w") as f:
+            access = {"owner": ["dummy"], "admin": [], "commit": ["other"]}
+            json.dump({"rpms": {"python-dummy": access}}, f)
+
+        with conf.supybot.plugins.Fedora.packages.primary_db.context(
+            primary_db
+        ), conf.supybot.plugins.Fedora.packages.acl_dump.context(acl_dump):
+            self.instance._reload_packages()
+            with mock.patch.object(self.instance.http.session, "get") as get:
+                self.assertResponse(
+                    "what python-dummy", "python-dummy: A dummy library"
+                )
+                get.return_value = mock.Mock(status_code=404, headers={})
+                self.assertResponse(
+                    "whoowns python-dummy",
+                    "\x02owner: \x02dummy; \x02commit: \x02other",
+                )
+                self.assertResponse(
+                    "what python-dumy",
+                    "No such package exists. Did you mean python-dummy?",
+                )
+                self.assertResponse(
+                    "whoowns dummy",
+                    "Package dummy not found. Did you mean dummy-tools?",
+                )
+        # Only the scm request, and the misses, went to the network
+        self.assertEqual(get.call_count, 4)
+        self.assertRegexp("cachestats", "packages: 2 summaries, 1 access lists")
+
+    def testResponseCache(self):
+        found = mock.Mock(status_code=200, headers={})
+        found.json.return_value = {"summary": "A dummy package"}
+        missing = mock.Mock(status_code=404, headers={})
+        with mock.patch.object(
+            self.instance.http.session, "get", side_effect=[found, missing]
+        ) as get:
+            self.assertResponse("what dummy", "dummy: A dummy package")
+            self.assertResponse("what dummy", "dummy: A dummy package")
+            self.assertResponse("what nothing", "No such package exists.")
+            self.assertResponse("what nothing", "No such package exists.")
+        self.assertEqual(get.call_count, 2)
+        self.assertRegexp("cachestats", "2/1000 entries, 2 hits .*, 2 misses")
+
+    def testStaleResponsesRefreshedByWorkers(self):
+        cache = self.instance.responses
+        cache.entries["key"] = ("old", time.time() - 1)
+        fetch = mock.Mock(return_value="new")
+        workers = self.instance.workers
+        with mock.patch.object(workers, "submit", wraps=workers.submit) as submit:
+            self.assertEqual(cache.get("key", fetch, 60), "old")
+        self.assertEqual(submit.call_count, 1)
+        wait_for(lambda: cache.entries["key"][0] == "new")
+
+    def testResponseCacheCoalesces(self):
+        started = threading.Event()
+        release = threading.Event()
+        fetch = mock.Mock(return_value="value")
+
+        def slow_fetch():
+            started.set()
+            release.wait(5)
+            return fetch()
+
+        cache = self.instance.responses
+        results = []
+        first = threading.Thread(
+            target=lambda: results.append(cache.get("key", slow_fetch, 60))
+        )
+        first.start()
+        started.wait(5)
+        second = threading.Thread(
+            target=lambda: results.append(cache.get("key", fetch, 60))
+        )
+        second.start()
+        wait_for(lambda: cache.coalesced)
+        release.set()
+        first.join(5)
+        second.join(5)
+        self.assertEqual(results, ["value", "value"])
+        self.assertEqual(fetch.call_count, 1)
+
+    def testHellomynameis(self):
+        users = {
+            "alice": {"username": "alice", "human_name": "Alice", "emails": ["a@x"]},
+            "bob": {"username": "bob", "human_name": "Bob", "emails": ["b@x"]},
+        }
+        self.fasjson_client.get_user.side_effect = lambda username: FASJSONResult(
+            users.get(username)
+        )
+        self.assertResponse("hellomynameis alice", "alice 'Alice' <a@x>")
+        self.assertResponse(
+            "hellomynameis nobody bob", "Sorry, but user 'nobody' does not exist"
+        )
+        m = self.getMsg(" ")
+        self.assertEqual(m.args[1], "bob 'Bob' <b@x>")
+        self.assertResponse("wikilink alice", "[[User:alice|Alice]]")
+        # Every user was only looked up once
+        self.assertEqual(self.fasjson_client.get_user.call_count, 3)
+        with conf.supybot.plugins.Fedora.workers.max_batch.context(1):
+            self.assertResponse(
+                "fasinfo alice bob", "Sorry, I can only look up 1 usernames at once."
+            )
+        self.assertEqual(self.fasjson_client.get_user.call_count, 3)
+
+    def testHellomynameisFromCache(self):
+        accounts = AccountCache(timestamp=time.time())
+        accounts.add("alice", "Alice", "a@x", ["alice_"])
+        self.instance.accounts = accounts
+        users = {
+            "alice": {
+                "username": "alice",
+                "human_name": "Alice B.",
+                "emails": ["ab@x"],
+            },
+            "bob": {"username": "bob", "human_name": "Bob", "emails": ["b@x"]},
+        }
+        self.fasjson_client.get_user.side_effect = lambda username: FASJSONResult(
+            users.get(username)
+        )
+        self.assertResponse("hellomynameis alice", "alice 'Alice' <a@x>")
+        self.assertResponse("wikilink alice", "[[User:alice|Alice]]")
+        self.fasjson_client.get_user.assert_not_called()
+        # Users missing from the cache are looked up
+        self.assertResponse("himynameis bob", "bob 'Slim Shady' <b@x>")
+        self.assertEqual(self.fasjson_client.get_user.call_count, 1)
+        # And so is everyone when the cache is too old, getting their
+        # current data
+        accounts.timestamp -= 2
+        with conf.supybot.plugins.Fedora.fasjson.cache_freshness.context(1):
+            self.assertResponse("hellomynameis alice", "alice 'Alice B.' <ab@x>")
+        self.fasjson_client.get_user.assert_called_with(username="alice")
+
+    def testBadgesAndMirrorAdmins(self):
+        unknown = mock.Mock(status_code=404, headers={})
+        unknown.json.return_value = {"error": "No such user exists."}
+        admins = mock.Mock(status_code=200, headers={})
+        admins.text = json.dumps({"admins": ["dummy", "test"]})
+        with mock.patch.object(
+            self.instance.http.session, "get", side_effect=[unknown, admins]
+        ):
+            self.assertResponse("badges nobody", "No such user exists.")
+            self.assertResponse(
+                "mirroradmins mirror.example.com",
+                "Mirror Admins of mirror.example.com: dummy test",
+            )
+        # Unknown users are only cached for the negative TTL
+        value, expires = self.instance.responses.entries[("badges", "nobody")]
+        self.assertLessEqual(expires - time.time(), 300)
+
+    def testWhoownsSecondaryTimeout(self):
+        def get(url, **kwargs):
+            if "fedora-scm-requests" in url:
+                raise requests.Timeout("too slow")
+            response = mock.Mock(status_code=200, headers={})
+            response.json.return_value = {
+                "access_users": {"owner": ["dummy"], "admin": [], "commit": []}
+            }
+            return response
+
+        with mock.patch.object(
+            self.instance.http.session, "get", side_effect=get
+        ) as get:
+            self.assertResponse("whoowns dummy", "\x02owner: \x02dummy")
+        # Both requests share the deadline of the command
+        for call in get.call_args_list:
+            connect, read = call[1]["timeout"]
+            self.assertLessEqual(read, 30)
+
+    def testWhoownsBatch(self):
+        scm_request = "bugzilla_contact:\n  Fedora: someone\n"
+
+        def get(url, **kwargs):
+            package = url.rsplit("/", 1)[1]
+            if package == "missing":
+                return mock.Mock(status_code=404, headers={})
+            if package == "broken" and "fedora-scm-requests" not in url:
+                response = mock.Mock(status_code=403, headers={})
+                response.json.return_value = {"error": "Forbidden"}
+                return response
+            if "fedora-scm-requests" in url:
+                return mock.Mock(status_code=200, headers={}, text=scm_request)
+            response = mock.Mock(status_code=200, headers={})
+            response.json.return_value = {
+                "access_users": {
+                    "owner": [package + "-owner"],
+                    "admin": [],
+                    "commit": [],
+                }
+            }
+            return response
+
+        with mock.patch.object(self.instance.http.session, "get", side_effect=get):
+            self.assertResponse(
+                "whoowns one missing broken",
+                "\x02one\x02: \x02owner: \x02one-owner - \x02Fedora\x02: someone",
+            )
+            m = self.getMsg(" ")
+            self.assertEqual(m.args[1], "\x02missing\x02: Package missing not found.")
+            m = self.getMsg(" ")
+            self.assertEqual(
+                m.args[1], "\x02broken\x02: Sorry, could not get the owners of broken."
+            )
+
+        with conf.supybot.plugins.Fedora.workers.max_batch.context(1):
+            with mock.patch.object(self.instance.http.session, "get") as get:
+                self.assertResponse(
+                    "whoowns one two", "Sorry, I can only look up 1 packages at once."
+                )
+            self.assertEqual(get.call_count, 0)
+
+    def testHTTPRetries(self):
+        http = HTTPClient(lambda service: 30, retries=2, backoff=0)
+        unavailable = mock.Mock(status_code=503, headers={})
+        ok = mock.Mock(status_code=200, headers={})
+        with mock.patch.object(
+            http.session,
+            "get",
+            side_effect=[requests.ConnectionError("refused"), unavailable, ok],
+        ) as get:
+            self.assertIs(http.get("dummy", "https://example.com"), ok)
+        self.assertEqual(get.call_count, 3)
+        # Slow services are not asked again
+        with mock.patch.object(
+            http.session, "get", side_effect=requests.ReadTimeout("too slow")
+        ) as get:
+            self.assertRaises(
+                requests.ReadTimeout, http.get, "dummy", "https://example.com"
+            )
+        self.assertEqual(get.call_count, 1)
+        # Nor is anything when waiting would go past the deadline
+        http.backoff = 10
+        with mock.patch.object(
+            http.session, "get", side_effect=requests.ConnectionError("refused")
+        ) as get:
+            self.assertRaises(
+                requests.ConnectionError,
+                http.get,
+                "dummy",
+                "https://example.com",
+                deadline=Deadline(5),
+            )
+        self.assertEqual(get.call_count, 1)
+
+    def testNewestPulls(self):
+        def get(url, **kwargs):
+            response = mock.Mock(status_code=200, headers={})
+            if url.startswith("https://api.github.com/users/"):
+                response.json.return_value = [{"name": "one"}, {"name": "two"}]
+            elif url.startswith("https://api.github.com/repos/"):
+                repo = url.split("/")[5]
+                if url.endswith("page=3"):
+                    days = [2, 1]
+                elif repo == "two":
+                    # Three pages of pull requests, newest first
+                    days = [8, 7, 6, 5]
+                    last = "https://api.github.com/repos/dummy/two/pulls?page=3"
+                    response.headers = {"link": f'<{last}>; rel="last"'}
+                else:
+                    days = [4, 3, 2, 1]
+                response.json.return_value = [
+                    {
+                        "user": {"login": "dummy"},
+                        "title": f"{repo} {day}",
+                        "html_url": f"https://github.com/dummy/{repo}",
+                        "created_at": f"2023-01-{day:02}T00:00:00Z",
+                    }
+                    for day in days
+                ]
+            else:
+                response.status_code = 404
+            return response
+
+        with mock.patch.object(self.instance.http.session, "get", side_effect=get):
+            newest, total, unreachable, complete = self.instance._newest_pulls(
+                "dummy", 3, Deadline(10)
+            )
+        self.assertEqual([p["title"] for p in newest], ["two 8", "two 7", "two 6"])
+        self.assertEqual(total, 14)
+        self.assertEqual(unreachable, ["pagure.io"])
+        self.assertTrue(complete)
+
+        # Return what was found when a repo is too slow to answer
+        slow = threading.Event()
+
+        def slow_get(url, **kwargs):
+            if "/two/" in url:
+                slow.wait(5)
+            return get(url, **kwargs)
+
+        with mock.patch.object(self.instance.http.session, "get", side_effect=slow_get):
+            newest, total, unreachable, complete = self.instance._newest_pulls(
+                "dummy", 3, Deadline(0.5)
+            )
+            slow.set()
+        self.assertEqual([p["title"] for p in newest], ["one 4", "one 3", "one 2"])
+        self.assertEqual(total, 4)
+        self.assertFalse(complete)
+
+    def testGitHubETags(self):
+        headers = {
+            "ETag": '"abc"',
+            "X-RateLimit-Limit": "5000",
+            "X-RateLimit-Remaining": "4000",
+            "X-RateLimit-Reset": str(int(time.time()) + 600),
+        }
+        url = "https://api.github.com/users/dummy/repos"
+        fetched = mock.Mock(
+            status_code=200, headers=headers, content=b'[{"name": "a"}]'
+        )
+        fetched.json.return_value = [{"name": "a"}]
+        not_modified = mock.Mock(status_code=304, headers=headers)
+        with mock.patch.object(
+            self.instance.http.session, "get", side_effect=[fetched, not_modified]
+        ) as get:
+            self.assertEqual(self.instance._github_get(url).json(), [{"name": "a"}])
+            self.assertEqual(self.instance._github_get(url).json(), [{"name": "a"}])
+            self.assertEqual(get.call_args[1]["headers"]["If-None-Match"], '"abc"')
+            # Stop revalidating when running out of requests
+            self.instance.http.rate_limits["github"].remaining = 10
+            self.assertEqual(self.instance._github_get(url).json(), [{"name": "a"}])
+            self.assertRaises(IOError, self.instance._github_get, url + "?page=2")
+        self.assertEqual(get.call_count, 2)
+        self.assertRegexp("httpstats", "github: 2 requests, .*10/5000 requests left")
+
+    def testWorkerPool(self):
+        workers = self.instance.workers
+        self.assertEqual(workers.map(lambda x: x * 2, range(20)), list(range(0, 40, 2)))
+        self.assertRaises(ZeroDivisionError, workers.map, lambda x: 1 / x, [1, 0])
+        self.assertRaises(TimeoutError, workers.map, time.sleep, [1] * 20, timeout=0.1)
+        self.assertEqual(workers.timed_out, 1)
+
+    def testSparklineCounts(self):
+        # Points of a daily sparkline are 1728 seconds wide
+        span, width = 86400, 1728
+        now = 1000 * width + 100
+        pages = {
+            1: [{"timestamp": 951 * width + 10}, {"timestamp": 951 * width + 20}],
+            2: [{"headers": {"sent-at": arrow.get(now - 50).isoformat()}}],
+        }
+
+        def get(url, params, **kwargs):
+            response = mock.Mock(status_code=200, headers={})
+            response.text = json.dumps(
+                {
+                    "total": 3,
+                    "pages": 2,
+                    "raw_messages": pages.get(params.get("page"), []),
+                }
+            )
+            return response
+
+        counts = self.instance._sparkline_counts
+        with mock.patch.object(
+            self.instance.http.session, "get", side_effect=get
+        ) as session_get:
+            values = counts(["bodhi"], span, now, Deadline(10))
+            self.assertEqual(session_get.call_count, 2)
+            self.assertEqual(len(values), 50)
+            self.assertEqual((values[0], values[-1], sum(values)), (2, 1, 3))
+
+            # Only the points which may still change are counted again
+            self.assertEqual(counts(["bodhi"], span, now + 60, Deadline(10)), values)
+            self.assertEqual(session_get.call_count, 4)
+            self.assertEqual(session_get.call_args[1]["params"]["start"], 999 * width)
+
+            # Too many pages, count each point of the sparkline instead
+            with conf.supybot.plugins.Fedora.quote.max_pages.context(1):
+                values = counts(["koji"], span, now, Deadline(10))
+            self.assertEqual(session_get.call_count, 55)
+            self.assertEqual(set(values), {3})
+
+    def testNextMeetings(self):
+        def meeting(name, days):
+            start = arrow.utcnow().shift(days=days)
+            return {
+                "meeting_name": name,
+                "meeting_date": start.format("YYYY-MM-DD"),
+                "meeting_time_start": start.format("HH:mm:ss"),
+            }
+
+        schedules = {
+            "one@irc.libera.chat": [meeting("a", 3), meeting("b", 1), meeting("c", -1)],
+            "two@irc.libera.chat": [meeting("d", 2), meeting("e", 4)],
+        }
+
+        def get(url, params, **kwargs):
+            if params["location"] not in schedules:
+                raise requests.Timeout("too slow")
+            response = mock.Mock(status_code=200, headers={})
+            response.json.return_value = {"meetings": schedules[params["location"]]}
+            return response
+
+        with mock.patch.object(self.instance.http.session, "get", side_effect=get):
+            meetings, complete = self.instance._next_meetings(
+                list(schedules), 3, Deadline(10)
+            )
+            self.assertEqual([m["meeting_name"] for _, m in meetings], ["b", "d", "a"])
+            self.assertTrue(complete)
+
+            meetings, complete = self.instance._next_meetings(
+                list(schedules) + ["three@irc.libera.chat"], 5, Deadline(10)
+            )
+            self.assertEqual(len(meetings), 4)
+            self.assertFalse(complete)
+
+    def testSchedule(self):
+        def meeting(name, start, end):
+            return {
+                "meeting_name": name,
+                "meeting_date": start.format("YYYY-MM-DD"),
+                "meeting_time_start": start.format("HH:mm:ss"),
+                "meeting_date_end": end.format("YYYY-MM-DD"),
+                "meeting_time_stop": end.format("HH:mm:ss"),
+            }
+
+        now = arrow.get("2021-06-15T12:00:00")
+        schedule = Schedule(
+            [
+                meeting("later", now.shift(days=1), now.shift(days=2)),
+                meeting("long", now.shift(days=-10), now.shift(days=10)),
+                meeting("over", now.shift(days=-3), now.shift(days=-2)),
+                meeting("short", now.shift(hours=-1), now.shift(hours=1)),
+            ]
+        )
+        now = now.naive
+        self.assertEqual(
+            [m["meeting_name"] for m in schedule.ongoing(now)], ["long", "short"]
+        )
+        self.assertEqual(
+            [m["meeting_name"] for _, m in schedule.upcoming(now)], ["later"]
+        )
+
+    def testQuote(self):
+        def get(url, params, **kwargs):
+            response = mock.Mock(status_code=200, headers={})
+            response.text = json.dumps({"total": 4, "pages": 1, "raw_messages": []})
+            return response
+
+        with mock.patch.object(self.instance.http.session, "get", side_effect=get):
+            self.assertResponse("quote BOD", "BOD, bodhi -100.00% over yesterday")
+            self.assertIn("over 24 hours", self.getMsg(" ").args[1])
+            self.assertIn("UTC", self.getMsg(" ").args[1])
+        self.assertRegexp("quote XYZ", "No such symbol 'XYZ'.  Try one of ANI, ANS")
+
+    def testRefreshCoalesces(self):
+        self.instance._refresh_lock.acquire()
+        try:
+            self.assertFalse(self.instance._refresh_in_background())
+            self.assertResponse("refresh", "The caches are already being refreshed.")
+        finally:
+            self.instance._refresh_lock.release()
 
 
 # vim:set shiftwidth=4 tabstop=4 expandtab textwidth=79:
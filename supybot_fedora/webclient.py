@@ -0,0 +1,288 @@
+###
+# Copyright (c) 2007, Mike McGrath
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+"""
+The HTTP client shared by every outbound call of the plugin.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+# Statuses telling that the service may well answer if asked again
+RETRY_STATUSES = (502, 503, 504)
+
+
+class DeadlineExceeded(requests.Timeout):
+    """Raised instead of making a request once its deadline has passed."""
+
+
+class Deadline(object):
+    """The time by which a command should be done talking to remote services.
+
+    Pass one to every request a command makes, so that their timeouts add up
+    to no more than the command's own.
+    """
+
+    def __init__(self, seconds):
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self):
+        return self.expires - time.monotonic()
+
+
+class ServiceStats(object):
+    """Counters for the requests made to one service."""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.elapsed = 0.0
+
+    def __str__(self):
+        average = self.elapsed / self.requests if self.requests else 0
+        return "%i requests, %i errors, %ims on average" % (
+            self.requests,
+            self.errors,
+            average * 1000,
+        )
+
+
+class RateLimit(object):
+    """The request budget a service advertises in its X-RateLimit headers."""
+
+    def __init__(self, limit, remaining, reset):
+        self.limit = limit
+        self.remaining = remaining
+        self.reset = reset
+
+    @classmethod
+    def from_headers(cls, headers):
+        """Return the RateLimit of a response, or None if it has none."""
+        try:
+            return cls(
+                int(headers["X-RateLimit-Limit"]),
+                int(headers["X-RateLimit-Remaining"]),
+                int(headers["X-RateLimit-Reset"]),
+            )
+        except (KeyError, ValueError):
+            return None
+
+    def nearly_exhausted(self, reserve):
+        """Whether at most ``reserve`` requests are left until the reset."""
+        return self.remaining <= reserve and time.time() < self.reset
+
+    def __str__(self):
+        return "%i/%i requests left, reset in %is" % (
+            self.remaining,
+            self.limit,
+            max(self.reset - time.time(), 0),
+        )
+
+
+class ETagCache(object):
+    """Responses kept with their ETag, to revalidate them with If-None-Match.
+
+    The ``size`` most recently used URLs are kept.  Only what callers use of
+    a response is kept: its body and a few headers.
+    """
+
+    headers = ("Content-Type", "ETag", "Link")
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.revalidated = 0
+        self.fetched = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def etag(self, url):
+        with self._lock:
+            entry = self.entries.get(url)
+        return None if entry is None else entry[0]["ETag"]
+
+    def response(self, url):
+        """Return the cached response for a URL, or None."""
+        with self._lock:
+            entry = self.entries.get(url)
+            if entry is None:
+                return None
+            self.entries.move_to_end(url)
+        headers, content = entry
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response.headers = CaseInsensitiveDict(headers)
+        response._content = content
+        return response
+
+    def store(self, url, response):
+        headers = {
+            name: response.headers[name]
+            for name in self.headers
+            if name in response.headers
+        }
+        with self._lock:
+            self.entries[url] = (headers, response.content)
+            self.entries.move_to_end(url)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def stats(self, name):
+        return "%s: %i/%i URLs, %i revalidated, %i fetched" % (
+            name,
+            len(self),
+            self.size,
+            self.revalidated,
+            self.fetched,
+        )
+
+
+class HTTPClient(object):
+    """A pooled requests session, with timeouts and retries per service.
+
+    Connections are kept alive in a pool per host, so that a burst of
+    commands hitting the same service reuses warm connections.  Requests
+    failing to connect or getting a 502, 503 or 504 are retried with an
+    exponential backoff, as long as their deadline allows.  Read timeouts are
+    not retried: a service that is too slow would most likely be as slow
+    again.
+
+    Every request names the service it is for, which picks its read timeout
+    through ``timeout_for`` and the counters it is accounted in.  The
+    timeouts are passed along with each request, never set process-wide.
+    """
+
+    def __init__(
+        self, timeout_for, connect_timeout=5, retries=2, backoff=0.5, pool_size=10
+    ):
+        self.timeout_for = timeout_for
+        self.connect_timeout = connect_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=20, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.stats = {}
+        self.rate_limits = {}
+        self._lock = threading.Lock()
+
+    def get(self, service, url, deadline=None, **kwargs):
+        """Make a GET request to a service.
+
+        If a Deadline is given, neither the timeouts of the attempts nor the
+        waits between them may go past it.
+        """
+        attempt = 0
+        while True:
+            try:
+                response = self._attempt(service, url, deadline, kwargs)
+            except requests.ConnectionError:
+                if not self._may_retry(attempt, deadline):
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES or not self._may_retry(
+                    attempt, deadline
+                ):
+                    return response
+                response.close()
+            time.sleep(self.backoff * 2**attempt)
+            attempt += 1
+
+    def get_cached(self, service, url, cache, headers=None, **kwargs):
+        """Make a GET request, revalidating what an ETagCache has for the URL.
+
+        A 304 response is answered with the cached response instead, and
+        successful responses with an ETag are added to the cache.
+        """
+        conditional = dict(headers or {})
+        etag = cache.etag(url)
+        if etag is not None:
+            conditional["If-None-Match"] = etag
+        response = self.get(service, url, headers=conditional, **kwargs)
+        if response.status_code == 304:
+            cached = cache.response(url)
+            if cached is not None:
+                cache.revalidated += 1
+                return cached
+            # Evicted in the meantime, fetch it all over again.
+            response = self.get(service, url, headers=headers, **kwargs)
+        if response.status_code == 200 and "ETag" in response.headers:
+            cache.fetched += 1
+            cache.store(url, response)
+        return response
+
+    def _attempt(self, service, url, deadline, kwargs):
+        connect, read = self.connect_timeout, self.timeout_for(service)
+        if deadline is not None:
+            remaining = deadline.remaining()
+            if remaining <= 0:
+                self._account(service, 0, True)
+                raise DeadlineExceeded("Deadline passed before requesting %s" % url)
+            connect, read = min(connect, remaining), min(read, remaining)
+        kwargs = dict(kwargs)
+        kwargs.setdefault("timeout", (connect, read))
+        start = time.time()
+        failed = True
+        try:
+            response = self.session.get(url, **kwargs)
+            failed = response.status_code >= 500
+        finally:
+            self._account(service, time.time() - start, failed)
+        rate_limit = RateLimit.from_headers(response.headers)
+        if rate_limit is not None:
+            self.rate_limits[service] = rate_limit
+        return response
+
+    def _may_retry(self, attempt, deadline):
+        if attempt >= self.retries:
+            return False
+        wait = self.backoff * 2**attempt
+        return deadline is None or deadline.remaining() > wait
+
+    def _account(self, service, elapsed, failed):
+        with self._lock:
+            stats = self.stats.setdefault(service, ServiceStats())
+            stats.requests += 1
+            stats.errors += failed
+            stats.elapsed += elapsed
+
+    def close(self):
+        self.session.close()
+
+
+# vim:set shiftwidth=4 tabstop=4 expandtab textwidth=79:
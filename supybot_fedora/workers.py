@@ -0,0 +1,138 @@
+###
+# Copyright (c) 2007, Mike McGrath
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+"""
+The pool of worker threads the plugin fans its requests out to.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+
+class WorkerPool(object):
+    """A fixed number of long-lived threads running tasks off a queue.
+
+    Tasks are submitted like to any executor, and return a Future which
+    raises the exception of a task that failed.  Tasks still waiting in the
+    queue can be cancelled, and are when the pool is shut down.
+    """
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self.executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix=name)
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.timed_out = 0
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        # Holding the lock keeps the task from starting before it is counted.
+        with self._lock:
+            future = self.executor.submit(self._run, fn, args, kwargs)
+            self.queued += 1
+            self._pending.add(future)
+        future.add_done_callback(self._done)
+        return future
+
+    def map(self, fn, items, timeout=None):
+        """Call fn on each item in the pool, and return the results in order.
+
+        The first exception raised by a call is raised again here, and if the
+        results are not all in after ``timeout`` seconds, TimeoutError is
+        raised.  Either way, the calls which have not started are cancelled.
+        """
+        futures = [self.submit(fn, item) for item in items]
+        end = None if timeout is None else time.monotonic() + timeout
+        try:
+            results = []
+            for future in futures:
+                remaining = None if end is None else max(end - time.monotonic(), 0)
+                results.append(future.result(remaining))
+            return results
+        except TimeoutError:
+            with self._lock:
+                self.timed_out += 1
+            raise
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def _run(self, fn, args, kwargs):
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self.running -= 1
+
+    def _done(self, future):
+        with self._lock:
+            self._pending.discard(future)
+            if future.cancelled():
+                self.queued -= 1
+                self.cancelled += 1
+            elif future.exception() is not None:
+                self.failed += 1
+            else:
+                self.completed += 1
+
+    def shutdown(self):
+        """Cancel the queued tasks, and let the running ones finish."""
+        with self._lock:
+            pending = list(self._pending)
+        for future in pending:
+            future.cancel()
+        self.executor.shutdown(wait=False)
+
+    def stats(self):
+        return (
+            "%s: %i threads, %i running, %i queued, %i completed, %i failed, "
+            "%i cancelled, %i timed out"
+            % (
+                self.name,
+                self.size,
+                self.running,
+                self.queued,
+                self.completed,
+                self.failed,
+                self.cancelled,
+                self.timed_out,
+            )
+        )
+
+
+# vim:set shiftwidth=4 tabstop=4 expandtab textwidth=79: